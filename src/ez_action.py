@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+import Queue
+import rospy
+import actionlib
+import threading
+
+from actionlib_msgs.msg import GoalStatus
+from ez_pick_and_place.msg import EzPickAndPlaceAction, EzPickAndPlaceResult, EzPickAndPlaceFeedback
+
+# Action server front end of EZToolSet's pick and place pipeline.
+# Goals are queued per arm and gripper move groups and run in order,
+# goals for different move groups run in parallel (same as the planning service).
+# Feedback is published after every stage, and a cancelled goal stops
+# between stages and between ik calls, unless the object has already been picked
+# (it is placed first). Goals cancelled while still queued never run
+class EZActionServer():
+
+    def __init__(self, ez_tools, name="ez_pnp/pick_and_place"):
+        self.ez_tools = ez_tools
+        # (arm, gripper) -> queue of goal handles
+        self.queues = dict()
+        self.lock = threading.Lock()
+        self.server = actionlib.ActionServer(name, EzPickAndPlaceAction, self.goalCallback, self.cancelCallback, auto_start=False)
+
+    def start(self):
+        self.server.start()
+
+    def goalCallback(self, gh):
+        goal = gh.get_goal()
+        with self.ez_tools.scene_lock.reading():
+            known = goal.graspit_target_object in self.ez_tools.ez_objects
+        if not known:
+            res = EzPickAndPlaceResult()
+            res.info = "Unknown object: " + goal.graspit_target_object
+            gh.set_rejected(res, res.info)
+            return
+        key = (goal.arm_move_group, goal.gripper_move_group)
+        with self.lock:
+            if key not in self.queues:
+                self.queues[key] = Queue.Queue()
+                t = threading.Thread(target=self.work, args=(self.queues[key],), name="ez_action_" + "_".join(key))
+                t.daemon = True
+                t.start()
+            self.queues[key].put(gh)
+
+    def cancelCallback(self, gh):
+        # Queued goals are dropped right away, running ones are preempted by execute
+        if gh.get_goal_status().status == GoalStatus.RECALLING:
+            res = EzPickAndPlaceResult()
+            res.info = "Cancelled before it started"
+            gh.set_canceled(res, res.info)
+
+    def work(self, queue):
+        while not rospy.is_shutdown():
+            gh = queue.get()
+            if gh.get_goal_status().status != GoalStatus.PENDING:
+                continue
+            # Accepted before anything can fail, a goal can only be aborted once active
+            gh.set_accepted()
+            try:
+                self.execute(gh)
+            except Exception as e:
+                res = EzPickAndPlaceResult()
+                res.info = str(e)
+                gh.set_aborted(res, res.info)
+
+    def execute(self, gh):
+        goal = gh.get_goal()
+        feedback = EzPickAndPlaceFeedback()
+        def preempted():
+            return gh.get_goal_status().status == GoalStatus.PREEMPTING
+        def setup(session):
+            def progress(stage, count):
+                feedback.stage = stage
+                if stage == feedback.GRASPS_PLANNED:
+                    feedback.grasps_planned = count
+                    feedback.grasps_valid = 0
+                elif stage == feedback.GRASPS_VALIDATED:
+                    feedback.grasps_valid = count
+                feedback.replanning_left = max(0, session.replanning)
+                gh.publish_feedback(feedback)
+            session.progress_cb = progress
+            session.preempt_check = preempted
+        res = self.ez_tools.inSession(goal, lambda session: session.planRequest(goal, EzPickAndPlaceResult()), setup)
+        if res.success:
+            gh.set_succeeded(res, res.info)
+        elif preempted():
+            gh.set_canceled(res, res.info)
+        else:
+            gh.set_aborted(res, res.info)
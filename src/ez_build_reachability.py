@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+import sys
+import time
+import numpy
+import rospy
+import argparse
+import ez_transforms
+import moveit_commander
+
+from ez_ik import EZIKPool, validIK
+from ez_services import EZServiceProxy
+from ez_reachability import EZReachabilityMap, approachQuaternions
+from moveit_msgs.srv import GetPositionIK, GetPositionIKRequest
+from geometry_msgs.msg import PoseStamped
+
+# Note:
+# Builds the reachability map of an arm move group offline, e.g.
+# rosrun ez_pick_and_place ez_build_reachability.py --group manipulator --min -1 -1 0 --max 1 1 1 --output ur3.ezrm
+# and then use it with the ez_pnp/reachability_map parameter.
+# Every voxel and orientation bin is sampled with the /compute_ik service of a running move_group,
+# or (with --stand-in-reach) with a local stand-in that only checks the distance from the arm's base
+
+# Local stand-in for /compute_ik: a pose is reachable if its distance from the base is within [min_reach, max_reach]
+class ReachStandIn():
+
+    def __init__(self, base, min_reach, max_reach):
+        self.base = numpy.asarray(base, dtype=numpy.float64)
+        self.min_reach = min_reach
+        self.max_reach = max_reach
+
+    def __call__(self, poses):
+        d = numpy.linalg.norm(poses[:, :3] - self.base, axis=1)
+        return (d >= self.min_reach) & (d <= self.max_reach)
+
+# Evaluates poses with the ik service, through an ik pool
+class IKEvaluator():
+
+    def __init__(self, group, frame_id, workers):
+        self.group = group
+        self.frame_id = frame_id
+        moveit_commander.roscpp_initialize(sys.argv)
+        rospy.init_node("ez_build_reachability", anonymous=True)
+        rospy.wait_for_service("/compute_ik")
+        proxy = EZServiceProxy("/compute_ik", GetPositionIK)
+        self.pool = EZIKPool(lambda: proxy, workers)
+        self.state = moveit_commander.RobotCommander().get_current_state()
+
+    def request(self, pose):
+        req = GetPositionIKRequest()
+        req.ik_request.group_name = self.group
+        req.ik_request.robot_state = self.state
+        # Reachability is about kinematics only, collisions change with the scene
+        req.ik_request.avoid_collisions = False
+        req.ik_request.pose_stamped = PoseStamped()
+        req.ik_request.pose_stamped.header.frame_id = self.frame_id
+        ez_transforms.arrayToPose(pose, req.ik_request.pose_stamped.pose)
+        return req
+
+    def __call__(self, poses):
+        responses = self.pool.evaluate([self.request(p) for p in poses])
+        return numpy.array([validIK(r) for r in responses], dtype=bool)
+
+# Sample every voxel and orientation bin of the map, samples times each (jittered inside the voxel and bin),
+# and fill the map's scores. The roll about the approach direction is spread evenly over the samples
+# (and jittered), since a bin can be reachable with some rolls only. chunk poses are evaluated at once
+def build(rmap, evaluate, samples=4, seed=0, chunk=4096):
+    rand = numpy.random.RandomState(seed)
+    centers = rmap.voxelCenters().reshape(-1, 3)
+    azimuth, elevation = rmap.binAngles()
+    bins = len(azimuth)
+    successes = numpy.zeros(len(centers) * bins, dtype=numpy.int32)
+    total = len(successes) * samples
+    start = time.time()
+    for s in xrange(samples):
+        for first in xrange(0, len(successes), chunk):
+            cells = numpy.arange(first, min(first + chunk, len(successes)))
+            v, b = cells // bins, cells % bins
+            positions = centers[v]
+            a, e = azimuth[b], elevation[b]
+            r = numpy.full(len(a), -numpy.pi + (s + 0.5) * (2 * numpy.pi / samples))
+            if samples > 1:
+                positions = positions + rand.uniform(-0.5, 0.5, positions.shape) * rmap.resolution
+                a = a + rand.uniform(-0.5, 0.5, len(a)) * (2 * numpy.pi / rmap.azimuth_bins)
+                e = e + rand.uniform(-0.5, 0.5, len(e)) * (numpy.pi / rmap.elevation_bins)
+                r = r + rand.uniform(-0.5, 0.5, len(r)) * (2 * numpy.pi / samples)
+            poses = numpy.hstack([positions, approachQuaternions(a, e, r)])
+            successes[cells] += evaluate(poses)
+            done = s * len(successes) + cells[-1] + 1
+            print "%d/%d poses, %.1fs" % (done, total, time.time() - start)
+    rmap.scores[...] = numpy.round(successes.reshape(rmap.scores.shape) * 255.0 / samples).astype(numpy.uint8)
+    return rmap
+
+# Spread every score to the neighboring voxels (same orientation bin), radius voxels away.
+# Sampling only checks a few poses per voxel, so this keeps the map on the safe side
+def dilate(rmap, radius=1):
+    scores = numpy.array(rmap.scores)
+    res = scores.copy()
+    n = scores.shape
+    for dx in xrange(-radius, radius + 1):
+        for dy in xrange(-radius, radius + 1):
+            for dz in xrange(-radius, radius + 1):
+                src = [slice(max(0, -d), n[i] - max(0, d)) for i, d in enumerate((dx, dy, dz))]
+                dst = [slice(max(0, d), n[i] - max(0, -d)) for i, d in enumerate((dx, dy, dz))]
+                res[tuple(dst)] = numpy.maximum(res[tuple(dst)], scores[tuple(src)])
+    rmap.scores[...] = res
+    return rmap
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the reachability map of an arm move group")
+    parser.add_argument("--group", default="manipulator")
+    parser.add_argument("--frame", default="world")
+    parser.add_argument("--min", type=float, nargs=3, required=True)
+    parser.add_argument("--max", type=float, nargs=3, required=True)
+    parser.add_argument("--resolution", type=float, default=0.05)
+    parser.add_argument("--azimuth-bins", type=int, default=8)
+    parser.add_argument("--elevation-bins", type=int, default=4)
+    parser.add_argument("--samples", type=int, default=4)
+    parser.add_argument("--dilate", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--stand-in-reach", type=float, nargs=2, metavar=("MIN", "MAX"))
+    parser.add_argument("--stand-in-base", type=float, nargs=3, default=[0.0, 0.0, 0.0])
+    parser.add_argument("--output", required=True)
+    # Skip the ros remapping arguments of rosrun/roslaunch
+    args = parser.parse_args([a for a in sys.argv[1:] if ":=" not in a])
+
+    lo = numpy.array(args.min)
+    shape = numpy.maximum(1, numpy.ceil((numpy.array(args.max) - lo) / args.resolution).astype(int))
+    scores = numpy.zeros(tuple(shape) + (args.azimuth_bins * args.elevation_bins,), dtype=numpy.uint8)
+    rmap = EZReachabilityMap(scores, lo, args.resolution, args.azimuth_bins, args.elevation_bins, args.frame)
+
+    if args.stand_in_reach:
+        evaluate = ReachStandIn(args.stand_in_base, args.stand_in_reach[0], args.stand_in_reach[1])
+    else:
+        evaluate = IKEvaluator(args.group, args.frame, args.workers)
+
+    build(rmap, evaluate, args.samples)
+    if args.dilate > 0:
+        dilate(rmap, args.dilate)
+    rmap.save(args.output)
+    print "Saved " + args.output + ": " + str(numpy.count_nonzero(rmap.scores)) + "/" + str(rmap.scores.size) + " reachable cells"
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+import numpy
+import threading
+import ez_mesh
+import ez_transforms
+
+# Broad phase collision pre-screen of place candidates.
+# Every scene model with an STL moveit file is kept as an oriented bounding box
+# (the axis aligned box of its mesh, posed like the model), and the placed object's box
+# is tested against all of them at once for every candidate pose, with the separating axis test.
+# Boxes overlapping by less than tolerance (e.g. an object resting on the table) do not count.
+# Models with other mesh formats are not screened, and neither are obstacles
+# of other frames than the candidates', so the ik service still has the final word
+class EZCollisionScreen():
+
+    def __init__(self, registry=None, tolerance=0.005):
+        self.registry = registry
+        self.tolerance = tolerance
+        # mesh file (or content hash, with a registry) -> (center, half extents) wrt the model
+        self.bounds = dict()
+        self.lock = threading.Lock()
+        # (names, frame ids, centers, rotations, half extents) of the scene models' boxes,
+        # replaced as a whole by update
+        self.boxes = ([], [], numpy.zeros((0, 3)), numpy.zeros((0, 3, 3)), numpy.zeros((0, 3)))
+
+    # (center, half extents) of the axis aligned box of a mesh file, or None if it is not an STL file.
+    # Meshes are only loaded once per file (per content, with a registry)
+    def meshBox(self, filename):
+        if filename == "" or not ez_mesh.isSTL(filename):
+            return None
+        key = self.registry.fileHash(filename) if self.registry is not None else filename
+        with self.lock:
+            if key in self.bounds:
+                return self.bounds[key]
+        vertices = self.registry.meshArrays(filename)[0] if self.registry is not None else ez_mesh.loadSTL(filename)[0]
+        lo, hi = vertices.min(axis=0), vertices.max(axis=0)
+        box = ((lo + hi) / 2, (hi - lo) / 2)
+        with self.lock:
+            self.bounds[key] = box
+        return box
+
+    # Rebuild the boxes of the specified EzModels, e.g. after every scene setup or update
+    def update(self, models):
+        names, frames, centers, rotations, extents = [], [], [], [], []
+        for model in models:
+            box = self.meshBox(model.moveit_file)
+            if box is None:
+                continue
+            pose = ez_transforms.poseToArray(model.pose.pose)
+            names.append(model.name)
+            frames.append(model.pose.header.frame_id)
+            centers.append(ez_transforms.composePoses(pose, numpy.r_[box[0], 0, 0, 0, 1])[:3])
+            rotations.append(ez_transforms.rotationMatrices(pose[3:]))
+            extents.append(box[1])
+        self.boxes = (names, frames, numpy.array(centers).reshape(-1, 3), numpy.array(rotations).reshape(-1, 3, 3), numpy.array(extents).reshape(-1, 3))
+
+    # Mask of the (M, 7) poses (of the specified frame) at which the specified model
+    # does not overlap any other model's box. Everything is free if the model has no box
+    def free(self, model, poses, frame_id):
+        poses = numpy.asarray(poses, dtype=numpy.float64).reshape(-1, 7)
+        res = numpy.ones(len(poses), dtype=bool)
+        box = self.meshBox(model.moveit_file)
+        names, frames, centers, rotations, extents = self.boxes
+        others = [i for i in xrange(len(names)) if names[i] != model.name and frames[i] == frame_id]
+        if box is None or not others or not len(poses):
+            return res
+        ca = ez_transforms.composePoses(poses, numpy.r_[box[0], 0, 0, 0, 1])[:, :3]
+        ra = ez_transforms.rotationMatrices(poses[:, 3:])
+        ea = numpy.maximum(box[1] - self.tolerance, 0.0)
+        eb = numpy.maximum(extents[others] - self.tolerance, 0.0)
+        return ~overlap(ca, ra, ea, centers[others], rotations[others], eb).any(axis=1)
+
+# Separating axis test of every pair of M boxes a with (3,) half extents ea,
+# and N boxes b with (N, 3) half extents eb. Centers are (M, 3) / (N, 3) and rotations
+# are (M, 3, 3) / (N, 3, 3) matrices (box axes as columns). Returns an (M, N) overlap mask
+def overlap(ca, ra, ea, cb, rb, eb):
+    # b's axes and center wrt each a
+    r = numpy.einsum("mki,nkj->mnij", ra, rb)
+    t = numpy.einsum("mki,mnk->mni", ra, cb[numpy.newaxis, :, :] - ca[:, numpy.newaxis, :])
+    abs_r = numpy.abs(r) + 1e-9
+    eb = eb[numpy.newaxis, :, :]
+    # a's axes
+    separated = numpy.any(numpy.abs(t) > ea + numpy.einsum("nj,mnij->mni", eb[0], abs_r), axis=2)
+    # b's axes
+    separated |= numpy.any(numpy.abs(numpy.einsum("mni,mnij->mnj", t, r)) > numpy.einsum("i,mnij->mnj", ea, abs_r) + eb, axis=2)
+    # Cross products of an a axis and a b axis
+    for i in xrange(3):
+        i1, i2 = (i + 1) % 3, (i + 2) % 3
+        for j in xrange(3):
+            j1, j2 = (j + 1) % 3, (j + 2) % 3
+            ra_ = ea[i1] * abs_r[:, :, i2, j] + ea[i2] * abs_r[:, :, i1, j]
+            rb_ = eb[:, :, j1] * abs_r[:, :, i, j2] + eb[:, :, j2] * abs_r[:, :, i, j1]
+            separated |= numpy.abs(t[:, :, i2] * r[:, :, i1, j] - t[:, :, i1] * r[:, :, i2, j]) > ra_ + rb_
+    return ~separated
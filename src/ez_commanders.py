@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import rospy
+import hashlib
+import threading
+
+# Creating a RobotCommander or a MoveGroupCommander loads the whole robot model
+# and opens new connections to move_group, so commanders are created once per group
+# and reused across requests, together with the data derived from them
+# (joint bounds, link names, end effector links and joint name -> index maps).
+# Everything is dropped when the robot description changes
+class EZCommanderPool():
+
+    def __init__(self, robot_factory, group_factory, description_param="/robot_description"):
+        self.robot_factory = robot_factory
+        self.group_factory = group_factory
+        self.description_param = description_param
+        self.description_hash = None
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            self.robot_commander = None
+            self.groups = dict()
+            self.joint_bounds = dict()
+            self.link_names = dict()
+            self.ee_links = dict()
+            self.joint_indices = dict()
+
+    # Drop everything if the robot description has changed since the last call.
+    # Returns True if it has
+    def refresh(self):
+        description = rospy.get_param(self.description_param, "")
+        h = hashlib.sha1(description).hexdigest()
+        with self.lock:
+            if h == self.description_hash:
+                return False
+            if self.description_hash is not None:
+                rospy.loginfo("ez_pnp: The robot description has changed, creating new commanders")
+            self.description_hash = h
+            self.clear()
+            return True
+
+    def robot(self):
+        with self.lock:
+            if self.robot_commander is None:
+                self.robot_commander = self.robot_factory()
+            return self.robot_commander
+
+    def group(self, name):
+        with self.lock:
+            if name not in self.groups:
+                self.groups[name] = self.group_factory(name)
+            return self.groups[name]
+
+    # Joint name -> upper limit, for every joint of the specified group
+    def jointBounds(self, name):
+        with self.lock:
+            if name not in self.joint_bounds:
+                robot = self.robot()
+                self.joint_bounds[name] = dict((joint, robot.get_joint(joint).max_bound()) for joint in self.group(name).get_joints())
+            return self.joint_bounds[name]
+
+    def linkNames(self, name):
+        with self.lock:
+            if name not in self.link_names:
+                self.link_names[name] = self.robot().get_link_names(name)
+            return self.link_names[name]
+
+    def endEffectorLink(self, name):
+        with self.lock:
+            if name not in self.ee_links:
+                self.ee_links[name] = self.group(name).get_end_effector_link()
+            return self.ee_links[name]
+
+    # Joint name -> index in the specified joint name list (e.g. of a joint state)
+    def jointIndex(self, names):
+        key = tuple(names)
+        with self.lock:
+            if key not in self.joint_indices:
+                self.joint_indices[key] = dict((key[i], i) for i in xrange(len(key)))
+            return self.joint_indices[key]
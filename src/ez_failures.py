@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+import time
+import numpy
+import threading
+
+from collections import OrderedDict
+
+# Memory of the grasp and place poses of each object that failed (no ik solution, failed motion),
+# so that replanning iterations and later requests try new candidates first.
+# Poses are quantized (per object, kind and frame), and every failure adds to the pose's weight:
+# 1 for a failed motion, ik_weight for a pose without an ik solution (which may depend on the arm's state).
+# Weights halve every half_life seconds, and are forgotten once they drop below forget_below.
+# Candidates with a weight are tried last (lightest first), and the ones weighing
+# at least skip_weight (by default, the motions that failed more than once, recently,
+# or poses that had no ik solution several times in a row) are not tried at all
+class EZFailureMemory():
+
+    def __init__(self, half_life=120.0, skip_weight=1.5, ik_weight=0.25, forget_below=0.1, size=4096, position_resolution=0.01, orientation_resolution=0.05):
+        self.half_life = half_life
+        self.skip_weight = skip_weight
+        self.ik_weight = ik_weight
+        self.forget_below = forget_below
+        self.size = size
+        self.position_resolution = position_resolution
+        self.orientation_resolution = orientation_resolution
+        # object name -> (kind, frame_id, quantized pose) -> [weight, time of the last failure], oldest first
+        self.objects = dict()
+        self.lock = threading.Lock()
+
+    # Quantized keys of (N, 7) poses. q and -q are the same rotation, so quaternions are kept with a non negative w
+    def keys(self, kind, frame_id, poses):
+        poses = numpy.asarray(poses, dtype=numpy.float64).reshape(-1, 7)
+        q = numpy.where(poses[:, 6:] < 0, -poses[:, 3:], poses[:, 3:])
+        cells = numpy.hstack([numpy.round(poses[:, :3] / self.position_resolution), numpy.round(q / self.orientation_resolution)]).astype(int)
+        return [(kind, frame_id) + tuple(c) for c in cells.tolist()]
+
+    def decayed(self, entry, now):
+        return entry[0] * 0.5 ** ((now - entry[1]) / self.half_life)
+
+    # Remember that the (N, 7) poses of the specified kind ("grasp" or "place") failed for the object,
+    # either in motion, or (if ik is True) only because they had no ik solution
+    def record(self, object_name, kind, frame_id, poses, ik=False):
+        weight = self.ik_weight if ik else 1.0
+        now = time.time()
+        with self.lock:
+            entries = self.objects.setdefault(object_name, OrderedDict())
+            for key in self.keys(kind, frame_id, poses):
+                entry = entries.pop(key, None)
+                entries[key] = [weight + (self.decayed(entry, now) if entry is not None else 0.0), now]
+            # Faded and, if still too many, the oldest failures go first
+            while entries:
+                key, entry = next(entries.iteritems())
+                if len(entries) <= self.size and self.decayed(entry, now) >= self.forget_below:
+                    break
+                del entries[key]
+
+    # Current weights of the (N, 7) poses, 0 for poses that never failed
+    def weights(self, object_name, kind, frame_id, poses):
+        now = time.time()
+        keys = self.keys(kind, frame_id, poses)
+        res = numpy.zeros(len(keys))
+        with self.lock:
+            entries = self.objects.get(object_name)
+            if entries:
+                for i in xrange(len(keys)):
+                    entry = entries.get(keys[i])
+                    if entry is not None:
+                        res[i] = self.decayed(entry, now)
+        return res
+
+    # The indices of the (N, 7) candidate poses in the order they should be tried
+    # (the same order, with remembered failures last), and the indices of the skipped ones
+    def order(self, object_name, kind, frame_id, poses):
+        w = self.weights(object_name, kind, frame_id, poses)
+        w[w < self.forget_below] = 0.0
+        skipped = numpy.flatnonzero(w >= self.skip_weight)
+        order = numpy.argsort(w, kind="mergesort")
+        return order[w[order] < self.skip_weight], skipped
+
+    # Forget the failures of the specified object, or of every object,
+    # e.g. after the scene has changed
+    def forget(self, object_name=None):
+        with self.lock:
+            if object_name is None:
+                self.objects.clear()
+            else:
+                self.objects.pop(object_name, None)
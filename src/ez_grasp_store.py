@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import numpy
+import ez_transforms
+
+from geometry_msgs.msg import PoseStamped
+from trajectory_msgs.msg import JointTrajectory, JointTrajectoryPoint
+
+# Validation status of a stored grasp
+UNKNOWN = 0
+VALID = 1
+INVALID = 2
+
+# The grasp candidates of a single planning session, kept in arrays:
+# (N, 7) end effector poses, (N, J) gripper postures, (N,) graspit qualities and (N,) validation statuses
+# of the grasps of the object_name object.
+# Messages are only created at the boundaries (ik requests, gripper commands),
+# and the store is dropped together with its session
+class EZGraspStore():
+
+    def __init__(self, poses, joint_names, postures, qualities, frame_id="world", object_name=""):
+        self.poses = numpy.asarray(poses, dtype=numpy.float64).reshape(-1, 7)
+        self.joint_names = list(joint_names)
+        self.postures = numpy.asarray(postures, dtype=numpy.float64).reshape(len(self.poses), len(self.joint_names))
+        self.qualities = numpy.asarray(qualities, dtype=numpy.float64).reshape(-1)
+        self.status = numpy.zeros(len(self.poses), dtype=numpy.int8)
+        self.frame_id = frame_id
+        self.object_name = object_name
+
+    # Build a store from moveit_msgs/Grasp messages and their (N, 7) end effector poses.
+    # Postures are taken from the first point of each grasp_posture
+    @staticmethod
+    def fromGrasps(grasps, poses, frame_id="world", object_name=""):
+        joint_names = list(grasps[0].grasp_posture.joint_names) if grasps else []
+        postures = numpy.zeros((len(grasps), len(joint_names)))
+        for i in xrange(len(grasps)):
+            points = grasps[i].grasp_posture.points
+            if points:
+                positions = points[0].positions[:len(joint_names)]
+                postures[i, :len(positions)] = positions
+        qualities = [g.grasp_quality for g in grasps]
+        return EZGraspStore(poses, joint_names, postures, qualities, frame_id, object_name)
+
+    def __len__(self):
+        return len(self.poses)
+
+    def poseStamped(self, i):
+        p = PoseStamped()
+        p.header.frame_id = self.frame_id
+        ez_transforms.arrayToPose(self.poses[i], p.pose)
+        return p
+
+    def posture(self, i):
+        t = JointTrajectory()
+        t.joint_names = list(self.joint_names)
+        t.points = [JointTrajectoryPoint(positions=self.postures[i].tolist())]
+        return t
+
+    def setStatus(self, i, status):
+        self.status[i] = status
+
+    # Indices of the grasps that have not been found invalid, in store order
+    def candidates(self):
+        return numpy.flatnonzero(self.status != INVALID)
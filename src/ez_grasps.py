@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import os
+import pickle
+import tempfile
+import threading
+import ez_transforms
+
+from StringIO import StringIO
+from collections import OrderedDict
+
+from moveit_msgs.msg import Grasp
+
+# Cache of GraspIt planning results, keyed on the gripper, the object model
+# and the object's quantized pose. GraspIt model IDs are reused across GraspIt restarts,
+# so the gripper and the object are identified by their names and the content hashes
+# of their graspit files instead (see EZToolSet.graspCacheKeys).
+# If a directory is specified, results are also persisted there, in one indexed file
+# per gripper and object model, so they survive node restarts.
+# At most max_models indexes are kept in memory (the least recently used ones are dropped,
+# and reloaded from disk when needed again), and at most max_poses poses per index.
+# Results that led to a failed pick are dropped (markFailed), so that the next
+# request for the same object and pose asks GraspIt for a fresh plan
+class EZGraspCache():
+
+    def __init__(self, directory="", position_resolution=0.001, orientation_resolution=0.001, max_models=64, max_poses=256):
+        self.directory = directory
+        self.position_resolution = position_resolution
+        self.orientation_resolution = orientation_resolution
+        self.max_models = max_models
+        self.max_poses = max_poses
+        # (gripper key, model key) -> {pose key: [serialized grasps]}, least recently used first
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        if self.directory and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def poseKey(self, pose_stamped):
+        return (pose_stamped.header.frame_id,) + ez_transforms.quantizePose(ez_transforms.poseToArray(pose_stamped.pose), self.position_resolution, self.orientation_resolution)
+
+    def filename(self, gripper, model):
+        return os.path.join(self.directory, gripper + "_" + model + ".grasps")
+
+    # Index of the specified model, loaded from disk the first time it is needed
+    def index(self, gripper, model):
+        key = (gripper, model)
+        index = self.models.pop(key, None)
+        if index is None:
+            index = OrderedDict()
+            if self.directory and os.path.isfile(self.filename(gripper, model)):
+                try:
+                    with open(self.filename(gripper, model), "rb") as f:
+                        index = OrderedDict(pickle.load(f))
+                except Exception as e:
+                    print "EZGraspCache:" + str(e)
+        self.models[key] = index
+        while len(self.models) > self.max_models:
+            self.models.popitem(last=False)
+        return index
+
+    def save(self, gripper, model):
+        if not self.directory:
+            return
+        # Write to a temporary file first, so that a crash never leaves a truncated index behind
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(self.index(gripper, model), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self.filename(gripper, model))
+
+    # The cached grasps for the specified object pose, or None if it has to be planned
+    def get(self, gripper, model, pose_stamped):
+        with self.lock:
+            serialized = self.index(gripper, model).get(self.poseKey(pose_stamped))
+            if not serialized:
+                return None
+        return [Grasp().deserialize(s) for s in serialized]
+
+    def put(self, gripper, model, pose_stamped, grasps):
+        if not grasps:
+            return
+        serialized = []
+        for g in grasps:
+            buff = StringIO()
+            g.serialize(buff)
+            serialized.append(buff.getvalue())
+        with self.lock:
+            index = self.index(gripper, model)
+            key = self.poseKey(pose_stamped)
+            index.pop(key, None)
+            index[key] = serialized
+            while len(index) > self.max_poses:
+                index.popitem(last=False)
+            self.save(gripper, model)
+
+    # None of the cached grasps worked, so force a fresh plan next time
+    def markFailed(self, gripper, model, pose_stamped):
+        with self.lock:
+            if self.index(gripper, model).pop(self.poseKey(pose_stamped), None) is not None:
+                self.save(gripper, model)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+import Queue
+import threading
+import ez_transforms
+
+from ez_stats import EZStats
+
+from collections import OrderedDict
+
+from moveit_msgs.msg import MoveItErrorCodes
+
+# Check if a GetPositionIK response holds a solution
+def validIK(response):
+    return response is not None and response.error_code.val == MoveItErrorCodes.SUCCESS
+
+# Check if a GetPositionIK response is definitive, i.e. a solution or no solution at all.
+# Timeouts and other failures may not happen again, so they are never cached
+def cacheableIK(response):
+    return response is not None and response.error_code.val in (MoveItErrorCodes.SUCCESS, MoveItErrorCodes.NO_IK_SOLUTION)
+
+# Bounded LRU cache of definitive GetPositionIK responses (see cacheableIK).
+# Entries are keyed on the group name, the quantized target pose, the avoid_collisions flag
+# and a fingerprint of the seed robot state (joint values and attached objects)
+class EZIKCache():
+
+    def __init__(self, size=4096, position_resolution=0.001, orientation_resolution=0.001):
+        self.size = size
+        self.position_resolution = position_resolution
+        self.orientation_resolution = orientation_resolution
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Incremented by invalidate, so that calls that started before it are not cached after it
+        self.generation = 0
+
+    # Hashable summary of a moveit_msgs/RobotState
+    def fingerprint(self, robot_state):
+        js = robot_state.joint_state
+        positions = tuple(int(round(v / self.position_resolution)) for v in js.position)
+        attached = tuple(sorted(a.object.id for a in robot_state.attached_collision_objects))
+        return hash((tuple(js.name), positions, attached))
+
+    def key(self, req, fingerprint=None):
+        ik = req.ik_request
+        if fingerprint is None:
+            fingerprint = self.fingerprint(ik.robot_state)
+        pose = ez_transforms.quantizePose(ez_transforms.poseToArray(ik.pose_stamped.pose), self.position_resolution, self.orientation_resolution)
+        return (ik.group_name, ik.pose_stamped.header.frame_id, pose, ik.avoid_collisions, fingerprint)
+
+    def get(self, key):
+        with self.lock:
+            response = self.entries.pop(key, None)
+            if response is None:
+                return None
+            self.entries[key] = response
+            return response
+
+    def put(self, key, response, generation=None):
+        if self.size <= 0 or not cacheableIK(response):
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries.pop(key, None)
+            self.entries[key] = response
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    # Forget every cached response, e.g. after the scene has changed
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+# The state of a single evaluate call, shared between the caller and the workers
+class EZIKBatch():
+
+    def __init__(self, requests, keys, stats, spans=None, generation=None):
+        self.requests = requests
+        self.keys = keys
+        self.generation = generation
+        self.stats = stats
+        self.spans = spans
+        self.responses = [None] * len(requests)
+        self.errors = [None] * len(requests)
+        self.finished = [False] * len(requests)
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    def done(self, index, response, error):
+        with self.cond:
+            self.responses[index] = response
+            self.errors[index] = error
+            self.finished[index] = True
+            self.cond.notify_all()
+
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+
+# A pool of worker threads that evaluates GetPositionIK requests concurrently.
+# Every worker creates its own service proxy once (through proxy_factory)
+# and keeps using it, so persistent connections are never shared between threads.
+# If a cache is specified, cached responses are returned without calling the service.
+# Service calls, cache hits and misses are recorded in the specified stats,
+# or in the stats of the individual calls. Service calls are timed as "compute_ik",
+# unless a span name is specified for each request
+class EZIKPool():
+
+    def __init__(self, proxy_factory, workers=4, cache=None, stats=None):
+        self.proxy_factory = proxy_factory
+        self.cache = cache
+        self.stats = stats if stats is not None else EZStats()
+        self.workers = max(1, workers)
+        self.jobs = Queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    # Spawn the workers the first time they are needed
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                t = threading.Thread(target=self.work, name="ez_ik_worker_" + str(len(self.threads)))
+                t.daemon = True
+                t.start()
+                self.threads.append(t)
+
+    def work(self):
+        proxy = self.proxy_factory()
+        while True:
+            batch, index = self.jobs.get()
+            if batch.stopped:
+                batch.done(index, None, None)
+                continue
+            try:
+                with batch.stats.span(batch.spans[index] if batch.spans is not None else "compute_ik"):
+                    response = proxy(batch.requests[index])
+                if batch.keys is not None:
+                    self.cache.put(batch.keys[index], response, batch.generation)
+                batch.done(index, response, None)
+            except Exception as e:
+                batch.done(index, None, e)
+                # The connection might be broken, start over with a fresh one
+                proxy = self.proxy_factory()
+
+    # Evaluate all requests concurrently and yield (index, response) tuples
+    # in the same order as the requests. Closing the generator (or stopping
+    # the iteration early) discards the requests that are still pending.
+    # If cache_state is specified, cache keys use it instead of the requests' own seed states,
+    # so that requests seeded differently (see ez_seed.py) still share their cached responses
+    def iterate(self, requests, stats=None, spans=None, cache_state=None):
+        self.start()
+        if stats is None:
+            stats = self.stats
+        keys = None
+        generation = None
+        if self.cache is not None:
+            generation = self.cache.generation
+            # Requests of a batch usually share the same seed state
+            fingerprints = dict()
+            keys = []
+            for req in requests:
+                state = cache_state if cache_state is not None else req.ik_request.robot_state
+                if id(state) not in fingerprints:
+                    fingerprints[id(state)] = self.cache.fingerprint(state)
+                keys.append(self.cache.key(req, fingerprints[id(state)]))
+        batch = EZIKBatch(requests, keys, stats, spans, generation)
+        for i in xrange(len(requests)):
+            response = self.cache.get(keys[i]) if keys is not None else None
+            if response is not None:
+                stats.count("ik_cache_hit")
+                batch.done(i, response, None)
+            else:
+                if keys is not None:
+                    stats.count("ik_cache_miss")
+                self.jobs.put((batch, i))
+        try:
+            for i in xrange(len(requests)):
+                with batch.cond:
+                    while not batch.finished[i]:
+                        batch.cond.wait()
+                if batch.errors[i] is not None:
+                    raise batch.errors[i]
+                yield i, batch.responses[i]
+        finally:
+            batch.stop()
+
+    # Evaluate all requests concurrently and return their responses in the same order.
+    # If max_valid is positive, stop as soon as the first max_valid requests
+    # (in request order) with a solution are found, so the result may be shorter
+    def evaluate(self, requests, max_valid=0, stats=None, spans=None, cache_state=None):
+        responses = []
+        valid = 0
+        it = self.iterate(requests, stats, spans, cache_state)
+        try:
+            for i, response in it:
+                responses.append(response)
+                if validIK(response):
+                    valid += 1
+                    if max_valid > 0 and valid >= max_valid:
+                        break
+        finally:
+            it.close()
+        return responses
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+import threading
+
+from contextlib import contextmanager
+
+# Many readers or a single writer. Waiting writers block new readers,
+# so scene changes are not starved by a stream of planning requests.
+# Not re-entrant: a thread must not acquire it again while holding it
+class EZReadWriteLock():
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+
+    @contextmanager
+    def reading(self):
+        with self.cond:
+            while self.writer or self.waiting_writers > 0:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                self.cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self.cond:
+            self.waiting_writers += 1
+            while self.writer or self.readers > 0:
+                self.cond.wait()
+            self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.writer = False
+                self.cond.notify_all()
+
+# One lock per key (e.g. per move group), created on first use
+class EZKeyedLocks():
+
+    def __init__(self):
+        self.locks = dict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.locks:
+                self.locks[key] = threading.Lock()
+            return self.locks[key]
+
+    # Hold the locks of all specified keys. They are always taken in the same (sorted) order,
+    # so that two requests sharing some keys cannot deadlock
+    @contextmanager
+    def holding(self, keys):
+        locks = [self.get(k) for k in sorted(set(keys))]
+        for l in locks:
+            l.acquire()
+        try:
+            yield
+        finally:
+            for l in reversed(locks):
+                l.release()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+import os
+import numpy
+
+from shape_msgs.msg import Mesh, MeshTriangle
+from geometry_msgs.msg import Point
+
+# Minimal STL loading, so meshes can be sent to MoveIt inside our own collision objects.
+# Meshes are kept as (V, 3) float vertex and (T, 3) int triangle arrays
+
+STL_TRIANGLE = numpy.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attributes", "<u2")])
+
+# Check if the specified file can be loaded by loadSTL
+def isSTL(filename):
+    return os.path.splitext(filename)[1].lower() == ".stl"
+
+# Load a binary or ASCII STL file and return its (vertices, triangles) arrays
+def loadSTL(filename):
+    with open(filename, "rb") as f:
+        data = f.read()
+    # ASCII files start with "solid", but so do some binary ones,
+    # so trust the size that the binary header claims first
+    if len(data) >= 84:
+        count = numpy.frombuffer(data, dtype="<u4", count=1, offset=80)[0]
+        if len(data) == 84 + count * STL_TRIANGLE.itemsize:
+            corners = numpy.frombuffer(data, dtype=STL_TRIANGLE, count=count, offset=84)["vertices"]
+            return indexed(corners.reshape(-1, 3))
+    corners = [line.split()[1:4] for line in data.splitlines() if line.strip().startswith("vertex")]
+    return indexed(numpy.array(corners, dtype=numpy.float64).reshape(-1, 3))
+
+# Merge duplicate triangle corners into shared vertices
+def indexed(corners):
+    vertices, triangles = numpy.unique(corners.astype(numpy.float64), axis=0, return_inverse=True)
+    return vertices, triangles.reshape(-1, 3)
+
+# (vertices, triangles) -> shape_msgs/Mesh
+def toMeshMsg(vertices, triangles, scale=(1.0, 1.0, 1.0)):
+    mesh = Mesh()
+    scaled = vertices * scale
+    mesh.vertices = [Point(v[0], v[1], v[2]) for v in scaled.tolist()]
+    mesh.triangles = [MeshTriangle(t) for t in triangles.tolist()]
+    return mesh
@@ -1,16 +1,34 @@
 #!/usr/bin/env python
 import sys
+import time
 import rospy
 import tf2_ros
 import moveit_commander
 
 from grasp_planning_graspit_msgs.srv import AddToDatabase, LoadDatabaseModel
-from ez_pick_and_place.srv import EzSceneSetup, EzStartPlanning
+from ez_pick_and_place.srv import EzSceneSetup, EzSceneUpdate, EzStartPlanning, EzStartPlanningBatch
+from ez_pick_and_place.msg import EzPlanningJobResult
 from moveit_msgs.srv import GraspPlanning, GetPositionIK
+from moveit_msgs.msg import PlanningScene
+from diagnostic_msgs.msg import DiagnosticArray
 
+from ez_ik import EZIKPool, EZIKCache
+from ez_seed import EZIKSeeds
+from ez_failures import EZFailureMemory
+from ez_grasps import EZGraspCache
+from ez_settle import EZSettleDetector
+from ez_stats import EZStats
+from ez_commanders import EZCommanderPool
+from ez_services import EZServiceManager
+from ez_session import EZSession
+from ez_action import EZActionServer
+from ez_reachability import EZReachabilityMap
+from ez_collision import EZCollisionScreen
+from ez_registry import EZModelRegistry
 from ez_tools import EZToolSet
 
 def main():
+    start = time.time()
     moveit_commander.roscpp_initialize(sys.argv)
     rospy.init_node("ez_pnp")
 
@@ -18,21 +36,64 @@ def main():
 
     ez_tools.debug = rospy.get_param("/ez_pnp/debug", False)
 
+    # Record stage timings and call counts, and publish them after every request
+    ez_tools.stats = EZStats(rospy.get_param("/ez_pnp/stats", False))
+    ez_tools.diagnostics_pub = rospy.Publisher("ez_pnp/diagnostics", DiagnosticArray, queue_size=10)
+
+    # Keep grasp plans in memory, or on disk if a directory is specified
+    ez_tools.grasp_cache = EZGraspCache(rospy.get_param("/ez_pnp/grasp_cache_dir", ""))
+
+    # Wait for the robot to settle instead of sleeping between stages
+    ez_tools.settle_detector = EZSettleDetector(rospy.get_param("/ez_pnp/settle", dict()))
+
+    # Reuse the moveit commanders across requests
+    ez_tools.commander_pool = EZCommanderPool(moveit_commander.RobotCommander, moveit_commander.MoveGroupCommander)
+
     ez_tools.moveit_scene = moveit_commander.PlanningSceneInterface()
+    ez_tools.planning_scene_pub = rospy.Publisher("planning_scene", PlanningScene, queue_size=1)
+    ez_tools.scene_workers = rospy.get_param("/ez_pnp/scene_workers", 4)
+    ez_tools.model_registry = EZModelRegistry(rospy.get_param("/ez_pnp/mesh_cache_bytes", 256 * 1024 * 1024))
     ez_tools.tf2_buffer = tf2_ros.Buffer()
     ez_tools.tf2_listener = tf2_ros.TransformListener(ez_tools.tf2_buffer)
 
-    ez_tools.add_model_srv = rospy.ServiceProxy("/graspit_add_to_database", AddToDatabase)
-    rospy.wait_for_service("/graspit_add_to_database")
-    ez_tools.load_model_srv = rospy.ServiceProxy("/graspit_load_model", LoadDatabaseModel)
-    rospy.wait_for_service("/graspit_load_model")
-    ez_tools.planning_srv = rospy.ServiceProxy("/graspit_eg_planning", GraspPlanning)
-    rospy.wait_for_service("/graspit_eg_planning")
-    ez_tools.compute_ik_srv = rospy.ServiceProxy("/compute_ik", GetPositionIK)
-    rospy.wait_for_service("/compute_ik")
-
-    start_srv = rospy.Service("ez_pnp/start_planning", EzStartPlanning, ez_tools.startPlanning)
-    scene_srv = rospy.Service("ez_pnp/scene_setup", EzSceneSetup, ez_tools.sceneSetup)
+    # All services are discovered concurrently, and every proxy keeps
+    # a persistent connection per thread (e.g. one per ik worker)
+    services = EZServiceManager(rospy.get_param("/ez_pnp/service_timeout", None), rospy.get_param("/ez_pnp/reconnect_timeout", 5.0))
+    ez_tools.add_model_srv = services.add("/graspit_add_to_database", AddToDatabase)
+    ez_tools.load_model_srv = services.add("/graspit_load_model", LoadDatabaseModel)
+    ez_tools.planning_srv = services.add("/graspit_eg_planning", GraspPlanning)
+    compute_ik_srv = services.add("/compute_ik", GetPositionIK)
+    # Resume the scene of the previous run (if any) before the first request is served
+    ez_tools.session = EZSession(rospy.get_param("/ez_pnp/session_file", ""))
+    services.whenReady(ez_tools.resumeSession)
+    # The action server is only started once graspit and moveit are available
+    action_server = EZActionServer(ez_tools)
+    services.whenReady(action_server.start)
+    # Drop unreachable candidates before asking for ik, if a map has been built for the arm
+    reachability_map = rospy.get_param("/ez_pnp/reachability_map", "")
+    if reachability_map:
+        ez_tools.reachability_map = EZReachabilityMap.load(reachability_map)
+        ez_tools.reachability_min_score = rospy.get_param("/ez_pnp/reachability_min_score", 0.0)
+    # Off by default: a box hides any cavity of its model (e.g. placing into a bin would always collide)
+    if rospy.get_param("/ez_pnp/collision_prescreen", False):
+        ez_tools.collision_screen = EZCollisionScreen(ez_tools.model_registry, rospy.get_param("/ez_pnp/collision_tolerance", 0.005))
+    if rospy.get_param("/ez_pnp/failure_memory", True):
+        ez_tools.failure_memory = EZFailureMemory(rospy.get_param("/ez_pnp/failure_half_life", 120.0), rospy.get_param("/ez_pnp/failure_skip_weight", 1.5),
+                                                  rospy.get_param("/ez_pnp/failure_ik_weight", 0.25))
+    ez_tools.ik_cache = EZIKCache(rospy.get_param("/ez_pnp/ik_cache_size", 4096))
+    if rospy.get_param("/ez_pnp/ik_seeding", True):
+        ez_tools.ik_seeds = EZIKSeeds(rospy.get_param("/ez_pnp/ik_seeds_size", 2048), max_distance=rospy.get_param("/ez_pnp/ik_seed_distance", 0.05))
+    ez_tools.ik_pool = EZIKPool(lambda: compute_ik_srv, rospy.get_param("/ez_pnp/ik_workers", 4), ez_tools.ik_cache, ez_tools.stats)
+
+    ez_tools.job_results_pub = rospy.Publisher("ez_pnp/job_results", EzPlanningJobResult, queue_size=10)
+    services.start()
+
+    # Advertise right away, requests wait until graspit and moveit are available
+    start_srv = rospy.Service("ez_pnp/start_planning", EzStartPlanning, services.gate(ez_tools.startPlanning))
+    batch_srv = rospy.Service("ez_pnp/start_planning_batch", EzStartPlanningBatch, services.gate(ez_tools.startPlanningBatch))
+    scene_srv = rospy.Service("ez_pnp/scene_setup", EzSceneSetup, services.gate(ez_tools.sceneSetup))
+    update_srv = rospy.Service("ez_pnp/scene_update", EzSceneUpdate, services.gate(ez_tools.sceneUpdate))
+    rospy.loginfo("ez_pnp: Services advertised after " + ("%.3f" % (time.time() - start)) + "s")
 
     rospy.spin()
 
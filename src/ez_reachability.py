@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+import numpy
+import struct
+import ez_transforms
+
+# Reachability map of an arm: for every (x, y, z) voxel of a grid and every end effector
+# approach direction bin (azimuth x elevation of the end effector's x axis), the fraction
+# of sampled poses (of any roll about that axis) that had an ik solution,
+# stored as a uint8 score (0 = never reachable, 255 = always).
+# Poses outside the grid were never sampled, so nothing is known about them.
+#
+# File format (little endian): a HEADER_SIZE byte header
+#   magic "EZRM", uint32 version, float64 origin x/y/z, float64 resolution,
+#   uint32 nx/ny/nz, uint32 azimuth bins, uint32 elevation bins, frame_id (64 bytes, zero padded)
+# followed by the (nx, ny, nz, azimuth bins * elevation bins) uint8 scores in C order.
+# Maps are built offline by ez_build_reachability.py, and loaded with numpy.memmap,
+# so a node never parses (or even reads) the whole file
+
+MAGIC = "EZRM"
+# Version 1 maps only sampled poses without roll
+VERSION = 2
+HEADER = struct.Struct("<4sIddddIIIII64s")
+HEADER_SIZE = 128
+
+# The end effector approach direction (the rotated x axis) of (N, 4) quaternions,
+# as (azimuth, elevation) angle arrays
+def approachAngles(quats):
+    x, y, z, w = quats[:, 0], quats[:, 1], quats[:, 2], quats[:, 3]
+    ax = 1 - 2 * (y * y + z * z)
+    ay = 2 * (x * y + w * z)
+    az = 2 * (x * z - w * y)
+    return numpy.arctan2(ay, ax), numpy.arcsin(numpy.clip(az, -1.0, 1.0))
+
+# (N, 4) quaternions with the specified approach angles, rolled by roll about the approach direction
+def approachQuaternions(azimuth, elevation, roll=0.0):
+    azimuth = numpy.asarray(azimuth, dtype=numpy.float64)
+    elevation = numpy.asarray(elevation, dtype=numpy.float64)
+    half = numpy.broadcast_to(numpy.asarray(roll, dtype=numpy.float64), azimuth.shape) * 0.5
+    # Yaw by the azimuth after pitching by -elevation (about y) after rolling (about x)
+    cy, sy = numpy.cos(azimuth / 2), numpy.sin(azimuth / 2)
+    cp, sp = numpy.cos(-elevation / 2), numpy.sin(-elevation / 2)
+    zeros = numpy.zeros_like(half)
+    return ez_transforms.quaternionMultiply(numpy.stack([-sy * sp, cy * sp, sy * cp, cy * cp], axis=-1),
+                                            numpy.stack([numpy.sin(half), zeros, zeros, numpy.cos(half)], axis=-1))
+
+class EZReachabilityMap():
+
+    def __init__(self, scores, origin, resolution, azimuth_bins, elevation_bins, frame_id="world"):
+        self.scores = scores
+        self.origin = numpy.asarray(origin, dtype=numpy.float64)
+        self.resolution = float(resolution)
+        self.azimuth_bins = azimuth_bins
+        self.elevation_bins = elevation_bins
+        self.frame_id = frame_id
+        self.shape = numpy.array(scores.shape[:3])
+
+    @staticmethod
+    def load(filename):
+        with open(filename, "rb") as f:
+            fields = HEADER.unpack(f.read(HEADER.size))
+        magic, version, ox, oy, oz, resolution, nx, ny, nz, azimuth_bins, elevation_bins, frame_id = fields
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(filename + " is not a version " + str(VERSION) + " reachability map")
+        scores = numpy.memmap(filename, dtype=numpy.uint8, mode="r", offset=HEADER_SIZE, shape=(nx, ny, nz, azimuth_bins * elevation_bins))
+        return EZReachabilityMap(scores, (ox, oy, oz), resolution, azimuth_bins, elevation_bins, frame_id.rstrip("\0"))
+
+    def save(self, filename):
+        nx, ny, nz = self.shape
+        header = HEADER.pack(MAGIC, VERSION, self.origin[0], self.origin[1], self.origin[2], self.resolution,
+                             nx, ny, nz, self.azimuth_bins, self.elevation_bins, self.frame_id)
+        with open(filename, "wb") as f:
+            f.write(header.ljust(HEADER_SIZE, "\0"))
+            f.write(numpy.ascontiguousarray(self.scores, dtype=numpy.uint8).tobytes())
+
+    # Center of every voxel, as an (nx, ny, nz, 3) array
+    def voxelCenters(self):
+        grid = numpy.indices(tuple(self.shape)).transpose(1, 2, 3, 0)
+        return self.origin + (grid + 0.5) * self.resolution
+
+    # Center angles of every orientation bin, as (azimuth, elevation) arrays in bin order
+    def binAngles(self):
+        a = -numpy.pi + (numpy.arange(self.azimuth_bins) + 0.5) * (2 * numpy.pi / self.azimuth_bins)
+        e = -numpy.pi / 2 + (numpy.arange(self.elevation_bins) + 0.5) * (numpy.pi / self.elevation_bins)
+        return numpy.repeat(a, self.elevation_bins), numpy.tile(e, self.azimuth_bins)
+
+    # Voxel and orientation bin indices of (N, 7) poses, and a mask of the poses inside the grid
+    def indices(self, poses):
+        poses = numpy.asarray(poses, dtype=numpy.float64).reshape(-1, 7)
+        voxels = numpy.floor((poses[:, :3] - self.origin) / self.resolution).astype(numpy.int64)
+        inside = numpy.all((voxels >= 0) & (voxels < self.shape), axis=1)
+        azimuth, elevation = approachAngles(poses[:, 3:])
+        a = numpy.floor((azimuth + numpy.pi) / (2 * numpy.pi) * self.azimuth_bins).astype(numpy.int64) % self.azimuth_bins
+        e = numpy.clip(numpy.floor((elevation + numpy.pi / 2) / numpy.pi * self.elevation_bins).astype(numpy.int64), 0, self.elevation_bins - 1)
+        return voxels, a * self.elevation_bins + e, inside
+
+    # Reachability scores in [0, 1] of (N, 7) poses, 0 outside the grid
+    def score(self, poses):
+        voxels, bins, inside = self.indices(poses)
+        res = numpy.zeros(len(voxels))
+        v = voxels[inside]
+        res[inside] = self.scores[v[:, 0], v[:, 1], v[:, 2], bins[inside]] / 255.0
+        return res
+
+    # Mask of the (N, 7) poses of the specified frame that score above min_score.
+    # Poses outside the grid or of any other frame cannot be checked, so they are all kept
+    def reachable(self, poses, frame_id, min_score=0.0):
+        res = numpy.ones(len(poses), dtype=bool)
+        if frame_id != self.frame_id:
+            return res
+        _, _, inside = self.indices(poses)
+        res[inside] = self.score(poses)[inside] > min_score
+        return res
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+import os
+import hashlib
+import threading
+import ez_mesh
+
+from collections import OrderedDict
+
+# sha1 of the content of the specified file
+def fileHash(filename):
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Key of the content of the specified file: its sha1, or the sha1 of its path if it cannot be read here
+# (e.g. a graspit file that only a GraspIt server on another host or container can open)
+def fileKey(filename, file_hash=fileHash):
+    try:
+        return file_hash(filename)
+    except (IOError, OSError):
+        return "path_" + hashlib.sha1(filename).hexdigest()
+
+# Content addressed registry of the models used in scene setups.
+# Remembers the graspit model IDs of already added models and which meshes
+# are already in the moveit scene (keyed on model name and file content hash),
+# and keeps parsed meshes in memory (as vertex and triangle arrays), evicting the least
+# recently used ones when more than max_mesh_bytes are resident
+class EZModelRegistry():
+
+    def __init__(self, max_mesh_bytes=256 * 1024 * 1024):
+        self.max_mesh_bytes = max_mesh_bytes
+        self.lock = threading.Lock()
+        # (path, mtime, size) -> content hash
+        self.hashes = dict()
+        # (model name, content key, kind) -> graspit model ID
+        self.graspit_ids = dict()
+        # model name -> content hash of the mesh in the moveit scene
+        self.moveit_meshes = dict()
+        # content hash -> [(vertices, triangles), resident bytes]
+        self.meshes = OrderedDict()
+        self.bytes_resident = 0
+        self.graspit_hits = 0
+        self.graspit_misses = 0
+        self.mesh_hits = 0
+        self.mesh_misses = 0
+
+    # Content hash of the specified file. Files are only re-read if their size or mtime changed
+    def fileHash(self, filename):
+        st = os.stat(filename)
+        key = (filename, st.st_mtime, st.st_size)
+        with self.lock:
+            if key in self.hashes:
+                return self.hashes[key]
+        h = fileHash(filename)
+        with self.lock:
+            self.hashes[key] = h
+        return h
+
+    # Content key of the specified file, see fileKey
+    def fileKey(self, filename):
+        return fileKey(filename, self.fileHash)
+
+    # The graspit model ID of an identical model added earlier, or None.
+    # Graspit files are only read if they are available locally, otherwise they are keyed by path
+    def graspitID(self, name, filename, kind):
+        key = (name, self.fileKey(filename), kind)
+        with self.lock:
+            if key in self.graspit_ids:
+                self.graspit_hits += 1
+                return self.graspit_ids[key]
+            self.graspit_misses += 1
+            return None
+
+    def rememberGraspitID(self, name, filename, kind, model_id):
+        key = (name, self.fileKey(filename), kind)
+        with self.lock:
+            self.graspit_ids[key] = model_id
+
+    # Every remembered graspit model ID, e.g. to keep them across restarts
+    def graspitIDs(self):
+        with self.lock:
+            return dict(self.graspit_ids)
+
+    def restoreGraspitIDs(self, graspit_ids):
+        with self.lock:
+            self.graspit_ids.update(graspit_ids)
+
+    # Check if the same mesh is already in the moveit scene under the specified name
+    def inMoveIt(self, name, filename):
+        return self.moveit_meshes.get(name) == self.fileHash(filename)
+
+    def rememberMoveIt(self, name, filename):
+        self.moveit_meshes[name] = self.fileHash(filename)
+
+    def forgetMoveIt(self, name):
+        self.moveit_meshes.pop(name, None)
+
+    # The (vertices, triangles) arrays of the specified STL file, parsed only once per content
+    def meshArrays(self, filename):
+        h = self.fileHash(filename)
+        with self.lock:
+            if h in self.meshes:
+                self.mesh_hits += 1
+                entry = self.meshes.pop(h)
+                self.meshes[h] = entry
+                return entry[0]
+            self.mesh_misses += 1
+        arrays = ez_mesh.loadSTL(filename)
+        size = arrays[0].nbytes + arrays[1].nbytes
+        with self.lock:
+            if h not in self.meshes:
+                self.meshes[h] = [arrays, size]
+                self.bytes_resident += size
+            while self.bytes_resident > self.max_mesh_bytes and len(self.meshes) > 1:
+                self.bytes_resident -= self.meshes.popitem(last=False)[1][1]
+        return arrays
+
+    # The shape_msgs/Mesh of the specified STL file. Messages are built per call
+    # and not kept, their per vertex objects take many times the memory of the arrays
+    def mesh(self, filename):
+        return ez_mesh.toMeshMsg(*self.meshArrays(filename))
+
+    def stats(self):
+        with self.lock:
+            return {"graspit_hits": self.graspit_hits,
+                    "graspit_misses": self.graspit_misses,
+                    "mesh_hits": self.mesh_hits,
+                    "mesh_misses": self.mesh_misses,
+                    "meshes_resident": len(self.meshes),
+                    "bytes_resident": self.bytes_resident}
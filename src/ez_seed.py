@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import numpy
+import threading
+
+from collections import OrderedDict
+
+from moveit_msgs.msg import RobotState
+from sensor_msgs.msg import JointState
+
+# A copy of robot_state with the specified joints set to the specified positions.
+# Everything else (other joints, attached objects) is shared with robot_state
+def seededState(robot_state, names, positions):
+    values = dict(zip(names, positions))
+    js = robot_state.joint_state
+    state = RobotState()
+    state.joint_state = JointState(header=js.header, name=js.name, position=[values.get(js.name[i], js.position[i]) for i in xrange(len(js.name))],
+                                   velocity=js.velocity, effort=js.effort)
+    state.multi_dof_joint_state = robot_state.multi_dof_joint_state
+    state.attached_collision_objects = robot_state.attached_collision_objects
+    state.is_diff = robot_state.is_diff
+    return state
+
+# Recent ik solutions of a move group, kept in a grid hash of their end effector positions,
+# so that new ik requests can be seeded with the solution of the nearest solved pose
+# instead of the current state of the robot. Neighbouring candidates (e.g. the heights of
+# a place pose, or grasps around the same object) usually converge in a few iterations from there.
+# Solutions are kept per move group and frame. The least recently updated cells are dropped
+# when more than size solutions are stored
+class EZIKSeeds():
+
+    def __init__(self, size=2048, cell_size=0.02, max_distance=0.05, orientation_weight=0.1):
+        self.size = size
+        self.cell_size = cell_size
+        self.max_distance = max_distance
+        self.orientation_weight = orientation_weight
+        # (group, frame_id, cell) -> list of (7 float pose, joint names, joint positions)
+        self.cells = OrderedDict()
+        self.count = 0
+        self.lock = threading.Lock()
+        # Cells to search around a pose's cell, enough to cover max_distance
+        r = int(numpy.ceil(max_distance / cell_size))
+        self.neighbours = [(dx, dy, dz) for dx in xrange(-r, r + 1) for dy in xrange(-r, r + 1) for dz in xrange(-r, r + 1)]
+
+    def cell(self, pose):
+        return tuple(int(numpy.floor(v / self.cell_size)) for v in pose[:3])
+
+    # Distance of (N, 7) poses from a pose: the position distance plus
+    # orientation_weight times the rotation angle between them
+    def distance(self, poses, pose):
+        d = numpy.linalg.norm(poses[:, :3] - pose[:3], axis=1)
+        dot = numpy.clip(numpy.abs(numpy.dot(poses[:, 3:], pose[3:])), 0.0, 1.0)
+        return d + self.orientation_weight * 2 * numpy.arccos(dot)
+
+    # Store the solution of an ik request, only keeping the specified joints (e.g. the active joints of the arm)
+    def add(self, group, frame_id, pose, solution, joint_names):
+        if self.size <= 0:
+            return
+        pose = numpy.asarray(pose, dtype=numpy.float64)
+        js = solution.joint_state
+        joints = set(joint_names)
+        names = [n for n in js.name if n in joints]
+        positions = [js.position[i] for i in xrange(len(js.name)) if js.name[i] in joints]
+        key = (group, frame_id, self.cell(pose))
+        with self.lock:
+            entries = self.cells.pop(key, [])
+            entries.append((pose, names, positions))
+            self.cells[key] = entries
+            self.count += 1
+            while self.count > self.size:
+                _, dropped = self.cells.popitem(last=False)
+                self.count -= len(dropped)
+
+    # (names, positions) of the stored solution nearest to pose, or None if none is within max_distance
+    def nearest(self, group, frame_id, pose):
+        pose = numpy.asarray(pose, dtype=numpy.float64)
+        cx, cy, cz = self.cell(pose)
+        found = []
+        with self.lock:
+            for dx, dy, dz in self.neighbours:
+                found.extend(self.cells.get((group, frame_id, (cx + dx, cy + dy, cz + dz)), ()))
+        if not found:
+            return None
+        d = self.distance(numpy.array([f[0] for f in found]), pose)
+        best = numpy.argmin(d)
+        if d[best] > self.max_distance:
+            return None
+        return found[best][1], found[best][2]
+
+    # The request's seed state, or a copy of it seeded with the nearest stored solution.
+    # Returns (robot_state, seeded)
+    def seed(self, group, frame_id, pose, robot_state):
+        res = self.nearest(group, frame_id, pose)
+        if res is None:
+            return robot_state, False
+        return seededState(robot_state, res[0], res[1]), True
+
+    # Forget every stored solution, e.g. after the robot has changed
+    def clear(self):
+        with self.lock:
+            self.cells.clear()
+            self.count = 0
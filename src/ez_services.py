@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+import time
+import rospy
+import threading
+
+# A service proxy that keeps a persistent connection per calling thread
+# (persistent connections cannot be shared between threads),
+# so that only the first call of each thread pays for the handshake.
+# If the connection breaks (e.g. the service was restarted), a new one is
+# opened and the call is retried once. The service has reconnect_timeout seconds
+# to come back, otherwise the call fails, so a dead service never blocks a caller forever
+class EZServiceProxy():
+
+    def __init__(self, name, service_class, reconnect_timeout=5.0):
+        self.name = name
+        self.service_class = service_class
+        self.reconnect_timeout = reconnect_timeout
+        self.local = threading.local()
+
+    def proxy(self):
+        p = getattr(self.local, "proxy", None)
+        if p is None:
+            p = rospy.ServiceProxy(self.name, self.service_class, persistent=True)
+            self.local.proxy = p
+        return p
+
+    def reconnect(self):
+        p = getattr(self.local, "proxy", None)
+        self.local.proxy = None
+        if p is not None:
+            try:
+                p.close()
+            except Exception:
+                pass
+
+    def __call__(self, *args, **kwargs):
+        try:
+            return self.proxy()(*args, **kwargs)
+        except (rospy.ServiceException, rospy.exceptions.TransportException) as e:
+            # The service itself failed, there is nothing wrong with the connection
+            if "responded with an error" in str(e):
+                raise
+            rospy.logwarn("ez_pnp: " + self.name + " connection lost (" + str(e) + "), reconnecting")
+            self.reconnect()
+            try:
+                rospy.wait_for_service(self.name, self.reconnect_timeout)
+            except rospy.ROSException:
+                raise rospy.ServiceException("ez_pnp: " + self.name + " is not available (" + str(e) + ")")
+            return self.proxy()(*args, **kwargs)
+
+# Waits for the services that ez_pnp depends on concurrently, instead of one after the other,
+# so that the ez_pnp services can be advertised right away (see gate).
+# How long each service took to show up is kept in durations
+class EZServiceManager():
+
+    def __init__(self, gate_timeout=None, reconnect_timeout=5.0):
+        # How long a gated callback waits for the services, None waits forever
+        self.gate_timeout = gate_timeout
+        # How long a proxy waits for its service to come back after a broken connection
+        self.reconnect_timeout = reconnect_timeout
+        self.proxies = dict()
+        self.durations = dict()
+        self.pending = set()
+        self.ready = threading.Event()
+        self.hooks = []
+        self.lock = threading.Lock()
+        self.start_time = None
+
+    # Register a service and return its proxy. The proxy can be used as soon as the manager is ready
+    def add(self, name, service_class):
+        if name not in self.proxies:
+            self.proxies[name] = EZServiceProxy(name, service_class, self.reconnect_timeout)
+        return self.proxies[name]
+
+    # Run the specified function once every service is available, before any gated callback
+    def whenReady(self, hook):
+        self.hooks.append(hook)
+
+    # Start waiting for every registered service in the background
+    def start(self):
+        self.start_time = time.time()
+        self.pending = set(self.proxies)
+        if not self.pending:
+            self.setReady()
+            return
+        for name in self.proxies:
+            t = threading.Thread(target=self.discover, args=(name,), name="ez_discover" + name.replace("/", "_"))
+            t.daemon = True
+            t.start()
+
+    def discover(self, name):
+        start = time.time()
+        while not rospy.is_shutdown():
+            try:
+                rospy.wait_for_service(name, 5.0)
+                break
+            except rospy.ROSException:
+                rospy.loginfo("ez_pnp: Still waiting for " + name)
+        else:
+            return
+        with self.lock:
+            self.durations[name] = time.time() - start
+            self.pending.discard(name)
+            rospy.loginfo("ez_pnp: " + name + " is available after " + ("%.3f" % self.durations[name]) + "s")
+            if self.pending:
+                return
+        rospy.loginfo("ez_pnp: All services are available after " + ("%.3f" % (time.time() - self.start_time)) + "s")
+        self.setReady()
+
+    def setReady(self):
+        for hook in self.hooks:
+            try:
+                hook()
+            except Exception as e:
+                print "EZServiceManager:" + str(e)
+        rospy.loginfo("ez_pnp: Ready after " + ("%.3f" % (time.time() - self.start_time)) + "s")
+        self.ready.set()
+
+    def waitReady(self, timeout=None):
+        self.ready.wait(timeout)
+        return self.ready.is_set()
+
+    # Wrap a service callback, so that it only runs once every registered service is available
+    def gate(self, callback):
+        def gated(req):
+            if not self.waitReady(self.gate_timeout):
+                with self.lock:
+                    missing = sorted(self.pending)
+                raise rospy.ServiceException("ez_pnp: Still waiting for " + ", ".join(missing))
+            return callback(req)
+        return gated
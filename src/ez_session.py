@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import os
+import pickle
+import tempfile
+import threading
+
+from StringIO import StringIO
+
+from ez_pick_and_place.msg import EzModel
+
+SNAPSHOT_VERSION = 1
+
+def serializeMsg(msg):
+    buff = StringIO()
+    msg.serialize(buff)
+    return buff.getvalue()
+
+# Snapshot of the scene knowledge of an EZToolSet (gripper, pose factor, models and their graspit IDs),
+# written to a single file after every change of the scene, so that a restarted node
+# can resume without a new scene setup.
+# Models are stored as serialized EzModel messages, so the file stays small
+class EZSession():
+
+    def __init__(self, filename=""):
+        self.filename = filename
+        self.lock = threading.Lock()
+
+    # snapshot: {"gripper_name": ..., "gripper_frame": ..., "gripper_id": ..., "pose_factor": ...,
+    #            "models": [(kind, EzModel, graspit model ID or None)], "graspit_ids": {...}}
+    def save(self, snapshot):
+        if not self.filename:
+            return
+        data = dict(snapshot)
+        data["version"] = SNAPSHOT_VERSION
+        data["models"] = [(kind, serializeMsg(model), model_id) for kind, model, model_id in snapshot["models"]]
+        with self.lock:
+            directory = os.path.dirname(os.path.abspath(self.filename))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # Write to a temporary file first, so that a crash never leaves a truncated snapshot behind
+            fd, tmp = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self.filename)
+
+    # The last saved snapshot, or None if there is none (or it cannot be read)
+    def load(self):
+        if not self.filename or not os.path.isfile(self.filename):
+            return None
+        try:
+            with self.lock:
+                with open(self.filename, "rb") as f:
+                    data = pickle.load(f)
+            if data.get("version") != SNAPSHOT_VERSION:
+                return None
+            data["models"] = [(kind, EzModel().deserialize(model), model_id) for kind, model, model_id in data["models"]]
+            return data
+        except Exception as e:
+            print "EZSession:" + str(e)
+            return None
+
+    # Forget the snapshot, e.g. because it no longer matches the graspit world
+    def clear(self):
+        if self.filename and os.path.isfile(self.filename):
+            os.remove(self.filename)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+import time
+import rospy
+import threading
+
+from sensor_msgs.msg import JointState
+
+# Replaces fixed sleeps between pipeline stages.
+# Watches the joint states and returns as soon as the robot is still
+# (or the attached object shows up in the planning scene), with a bounded timeout.
+# Each stage can have its own timeout and velocity threshold, e.g. through the parameter server:
+# ez_pnp/settle: {open_gripper: {timeout: 1.0, velocity_threshold: 0.01}, ...}
+class EZSettleDetector():
+
+    default_timeout = 1.0
+    default_velocity_threshold = 0.01
+
+    def __init__(self, stages=None, topic="joint_states"):
+        self.stages = stages if stages is not None else dict()
+        # Stage -> how long its last wait actually took
+        self.durations = dict()
+        self.velocities = dict()
+        self.positions = dict()
+        self.stamps = dict()
+        # Number of joint state messages received so far
+        self.received = 0
+        self.cond = threading.Condition()
+        self.sub = rospy.Subscriber(topic, JointState, self.jointStatesCallback)
+
+    def jointStatesCallback(self, msg):
+        now = msg.header.stamp.to_sec() if msg.header.stamp else rospy.get_time()
+        with self.cond:
+            for i in xrange(len(msg.name)):
+                name = msg.name[i]
+                if len(msg.velocity) == len(msg.name):
+                    self.velocities[name] = abs(msg.velocity[i])
+                # Some drivers do not publish velocities, so approximate them
+                elif name in self.positions and now > self.stamps[name]:
+                    self.velocities[name] = abs(msg.position[i] - self.positions[name]) / (now - self.stamps[name])
+                if len(msg.position) == len(msg.name):
+                    self.positions[name] = msg.position[i]
+                    self.stamps[name] = now
+            self.received += 1
+            self.cond.notify_all()
+
+    def config(self, stage):
+        cfg = self.stages.get(stage, dict())
+        return cfg.get("timeout", self.default_timeout), cfg.get("velocity_threshold", self.default_velocity_threshold)
+
+    def still(self, joints, threshold):
+        if joints is None:
+            joints = self.velocities.keys()
+        for j in joints:
+            if j not in self.velocities or self.velocities[j] > threshold:
+                return False
+        return True
+
+    def report(self, stage, start, settled):
+        self.durations[stage] = time.time() - start
+        rospy.logdebug("ez_pnp settle " + stage + ": " + str(self.durations[stage]) + "s" + ("" if settled else " (timed out)"))
+        return settled
+
+    # Wait until the specified joints (all of them if None) are still,
+    # based on joint states received after the call
+    def waitForStill(self, stage, joints=None):
+        timeout, threshold = self.config(stage)
+        start = time.time()
+        with self.cond:
+            received = self.received
+            while not rospy.is_shutdown():
+                if self.received > received and self.still(joints, threshold):
+                    return self.report(stage, start, True)
+                remaining = timeout - (time.time() - start)
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+        return self.report(stage, start, False)
+
+    # Wait until the specified object is attached to the robot in the planning scene
+    def waitForAttached(self, stage, scene, object_name):
+        timeout = self.config(stage)[0]
+        start = time.time()
+        while not rospy.is_shutdown():
+            if object_name in scene.get_attached_objects([object_name]):
+                return self.report(stage, start, True)
+            if time.time() - start >= timeout:
+                break
+            time.sleep(0.01)
+        return self.report(stage, start, False)
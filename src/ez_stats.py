@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+import time
+import threading
+
+from ez_pick_and_place.msg import EzStageTiming
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+
+# Does nothing, returned by span() while the stats are disabled
+class EZNoSpan():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+NO_SPAN = EZNoSpan()
+
+# Times a single run of a stage, see EZStats.span
+class EZSpan():
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.record(self.name, time.time() - self.start)
+        return False
+
+# Timing spans and call counts of the pipeline stages and the external service calls,
+# plus the number of ik candidates evaluated and how many of them had a solution.
+# Spans can be recorded from any thread. While disabled, span() and every counter
+# return immediately, so the instrumentation can stay in place
+class EZStats():
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # Stage name -> [calls, total seconds, max seconds]
+            self.stages = dict()
+            self.ik_evaluated = 0
+            self.ik_valid = 0
+
+    # with stats.span("graspit_planning"): ...
+    def span(self, name):
+        if not self.enabled:
+            return NO_SPAN
+        return EZSpan(self, name)
+
+    def record(self, name, duration):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [1, duration, duration]
+            else:
+                stage[0] += 1
+                stage[1] += duration
+                stage[2] = max(stage[2], duration)
+
+    # Count an event that has no duration, e.g. an ik cache hit
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                self.stages[name] = [n, 0.0, 0.0]
+            else:
+                stage[0] += n
+
+    # Count an evaluated ik candidate
+    def ik(self, valid):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.ik_evaluated += 1
+            if valid:
+                self.ik_valid += 1
+
+    def ikSuccessRatio(self):
+        if self.ik_evaluated == 0:
+            return 0.0
+        return float(self.ik_valid) / self.ik_evaluated
+
+    # The recorded stages as EzStageTiming messages, sorted by name
+    def timings(self):
+        res = []
+        with self.lock:
+            for name in sorted(self.stages):
+                t = EzStageTiming()
+                t.name = name
+                t.calls, t.total, t.max = self.stages[name]
+                res.append(t)
+        return res
+
+    # Fill the stats fields of an EzStartPlanning response
+    def fill(self, response):
+        response.timings = self.timings()
+        response.ik_candidates_evaluated = self.ik_evaluated
+        response.ik_valid_candidates = self.ik_valid
+        response.ik_success_ratio = self.ikSuccessRatio()
+        return response
+
+    # The recorded stats as a DiagnosticArray with a single status,
+    # e.g. ez_pnp start_planning: graspit_planning calls = 1, graspit_planning total = 12.3, ...
+    def diagnostics(self, name, message=""):
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = "ez_pnp " + name
+        status.message = message
+        for t in self.timings():
+            status.values.append(KeyValue(t.name + " calls", str(t.calls)))
+            status.values.append(KeyValue(t.name + " total", str(t.total)))
+            status.values.append(KeyValue(t.name + " max", str(t.max)))
+        status.values.append(KeyValue("ik_candidates_evaluated", str(self.ik_evaluated)))
+        status.values.append(KeyValue("ik_valid_candidates", str(self.ik_valid)))
+        status.values.append(KeyValue("ik_success_ratio", str(self.ikSuccessRatio())))
+        arr = DiagnosticArray()
+        arr.status = [status]
+        return arr
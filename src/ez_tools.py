@@ -1,18 +1,28 @@
 #!/usr/bin/env python
 import tf
+import copy
 import time
 import numpy
+import threading
 import rospy
+import ez_mesh
+import ez_registry
+import ez_transforms
 import moveit_commander
 
-from math import sqrt, atan2
-from tf.transformations import quaternion_from_euler, quaternion_multiply
+from math import sqrt
+from ez_ik import validIK
+from ez_stats import EZStats
+from ez_locks import EZReadWriteLock, EZKeyedLocks
+from ez_grasp_store import EZGraspStore, VALID, INVALID
 
-from grasp_planning_graspit_msgs.srv import AddToDatabaseRequest, LoadDatabaseModelRequest
+from grasp_planning_graspit_msgs.srv import AddToDatabaseRequest, LoadDatabaseModelRequest, LoadDatabaseModelResponse
 from moveit_msgs.srv import GetPositionIKRequest, GraspPlanning, GetPositionIK
-from geometry_msgs.msg import TransformStamped, PoseStamped, Pose
-from ez_pick_and_place.srv import EzSceneSetupResponse
-from moveit_msgs.msg import CollisionObject
+from geometry_msgs.msg import PoseStamped, Pose
+from ez_pick_and_place.srv import EzSceneSetupResponse, EzSceneUpdateRequest, EzSceneUpdateResponse, EzStartPlanningResponse
+from ez_pick_and_place.msg import EzPlanningJobResult
+from moveit_msgs.msg import CollisionObject, PlanningScene, MoveItErrorCodes
+from multiprocessing.pool import ThreadPool
 
 class EZToolSet():
 
@@ -22,6 +32,7 @@ class EZToolSet():
     gripper_move_group = ""
     arm_move_group_name = ""
     gripper_move_group_name = ""
+    commander_pool = None
 
     pose_factor = 1000
 
@@ -35,45 +46,104 @@ class EZToolSet():
 
     ez_objects = dict()
     ez_obstacles = dict()
+    # Every model of the scene (name -> [kind, EzModel]), with its latest pose
+    scene_models = dict()
 
-    pose_n_joint = dict()
     gripper_joint_bounds = dict()
 
     gripper_name = None
+    gripper_file = None
     gripper_frame = None
+    gripper_id = None
 
     target_place = None
 
-    grasp_poses = []
+    # The grasp candidates of the current request, see ez_grasp_store.py
+    grasp_store = None
 
-    compute_ik_srv = None
+    ik_pool = None
+    ik_cache = None
+    # Previous ik solutions used as seeds for nearby candidates, see ez_seed.py
+    ik_seeds = None
+
+    # Cost of one radian of end effector yaw change, in meters of motion
+    place_yaw_weight = 0.1
+    # Number of place candidates sent to the ik pool at once
+    place_batch_size = 32
+
+    # Offline reachability map of the arm (see ez_reachability.py).
+    # Candidates that score no more than reachability_min_score are dropped before any ik call
+    reachability_map = None
+    reachability_min_score = 0.0
+
+    # Grasp and place poses that failed before, tried last (see ez_failures.py)
+    failure_memory = None
+
+    # Bounding box pre-screen of the place candidates against the scene models, see ez_collision.py
+    collision_screen = None
+
+    grasp_cache = None
+
+    settle_detector = None
+
+    job_results_pub = None
+
+    # Number of models loaded to graspit concurrently during scene setup
+    scene_workers = 4
+    planning_scene_pub = None
+    model_registry = None
+
+    # Keeps the scene knowledge on disk, see ez_session.py
+    session = None
+
+    # Scene setups and updates change the scene exclusively, planning requests only hold it
+    # while taking their snapshot of it (see requestSession)
+    scene_lock = EZReadWriteLock()
+    # Only one request at a time per move group, requests for different arms run in parallel
+    group_locks = EZKeyedLocks()
+    # The toolset a session was taken from, whose scene is updated after a place (see placedAt)
+    owner = None
+
+    # Timings and call counts of the pipeline stages, see ez_stats.py
+    stats = EZStats()
+    diagnostics_pub = None
 
     error_info = ""
 
     replanning = 0
 
     already_picked = False
+    # The object is in the gripper (picked and not placed yet)
+    holding = False
+
+    # Request hooks, set per session (e.g. by the action server):
+    # progress(stage, count) is called after each stage of the pipeline,
+    # preempt_check() returns True if the request should stop as soon as possible
+    progress_cb = None
+    preempt_check = None
 
     debug = False
 
     # Move the whole arm to the specified pose
     def move(self, pose):
         self.arm_move_group.set_pose_target(pose)
-        return self.arm_move_group.go()
+        with self.stats.span("move_arm"):
+            return self.arm_move_group.go()
 
     # Move the whole arm to the specified state
     def moveToState(self, state):
         self.arm_move_group.set_joint_value_target(state)
-        return self.arm_move_group.go()
+        with self.stats.span("move_arm"):
+            return self.arm_move_group.go()
 
     # Maximize all gripper joints
     def openGripper(self):
         curr_state = self.robot_commander.get_current_state()
         joint_pos = list(curr_state.joint_state.position)
-        names = curr_state.joint_state.name
-        for i in xrange(len(names)):
-                if names[i] in self.gripper_joint_bounds:
-                    joint_pos[i] = self.gripper_joint_bounds[names[i]]
+        index = self.jointIndex(curr_state.joint_state.name)
+        for joint in self.gripper_joint_bounds:
+            if joint in index:
+                joint_pos[index[joint]] = self.gripper_joint_bounds[joint]
         curr_state.joint_state.position = joint_pos
         return self.moveGripperToState(curr_state)
 
@@ -90,59 +160,151 @@ class EZToolSet():
         curr_state = self.robot_commander.get_current_state()
         joint_pos = list(curr_state.joint_state.position)
         names = curr_state.joint_state.name
+        index = self.jointIndex(names)
         for i in xrange(len(graspit_result.joint_names)):
-            for j in xrange(len(names)):
-                if graspit_result.joint_names[i] == names[j]:
-                    joint_pos[j] = self.gripper_joint_bounds[names[j]] - abs(graspit_result.points[0].positions[i] / self.pose_factor)
-                    break
+            j = index.get(graspit_result.joint_names[i])
+            if j is not None:
+                joint_pos[j] = self.gripper_joint_bounds[names[j]] - abs(graspit_result.points[0].positions[i] / self.pose_factor)
         curr_state.joint_state.position = joint_pos
         return self.moveGripperToState(curr_state)
 
     # Move all gripper joints to the specified state
     def moveGripperToState(self, state):
         self.gripper_move_group.set_joint_value_target(state)
-        return self.gripper_move_group.go()
+        with self.stats.span("move_gripper"):
+            return self.gripper_move_group.go()
 
     # Shortcut of tf's lookup_transform
     def lookupTF(self, target_frame, source_frame):
-        return self.tf2_buffer.lookup_transform(target_frame, source_frame, rospy.Time(), rospy.Duration(10))
+        with self.stats.span("tf_lookup"):
+            return self.tf2_buffer.lookup_transform(target_frame, source_frame, rospy.Time(), rospy.Duration(10))
+
+    # lookupTF with retries, returns None if every try failed
+    def lookupTFRetry(self, target_frame, source_frame, caller):
+        for tryagain in xrange(0,4):
+            try:
+                return self.lookupTF(target_frame, source_frame)
+            except Exception as e:
+                print caller + ":" + str(e)
+        return None
 
-    # Call graspit for the specified object
+    # Call graspit for the specified object,
+    # unless it has already been planned for the same pose
     def graspThis(self, object_name):
+        model_id, pose = self.ez_objects[object_name]
+        keys = self.graspCacheKeys(object_name)
+        if keys is not None:
+            grasps = self.grasp_cache.get(keys[0], keys[1], pose)
+            if grasps is not None:
+                self.stats.count("grasp_cache_hit")
+                return grasps
+            self.stats.count("grasp_cache_miss")
         target = CollisionObject()
-        target.id = str(self.ez_objects[object_name][0])
-        target.primitive_poses = [self.ez_objects[object_name][1].pose]
-        response = self.planning_srv(group_name = self.gripper_name, target = target)
+        target.id = str(model_id)
+        target.primitive_poses = [pose.pose]
+        with self.stats.span("graspit_planning"):
+            response = self.planning_srv(group_name = self.gripper_name, target = target)
+        if keys is not None:
+            self.grasp_cache.put(keys[0], keys[1], pose, response.grasps)
         return response.grasps
 
+    # The gripper and object model keys of the grasp cache. GraspIt model IDs are reused
+    # after a GraspIt restart, so models are identified by name and graspit file content
+    # (or path, if the file is not available locally, see ez_registry.fileKey).
+    # None if there is no grasp cache, or the gripper file is unknown (a session saved before it was kept)
+    def graspCacheKeys(self, object_name):
+        if self.grasp_cache is None or self.gripper_file is None:
+            return None
+        model = self.scene_models[object_name][1]
+        file_key = self.model_registry.fileKey if self.model_registry is not None else ez_registry.fileKey
+        return self.gripper_name + "_" + file_key(self.gripper_file), object_name + "_" + file_key(model.graspit_file)
+
+    # The last grasp plan of the specified object did not lead to a pick,
+    # so do not reuse it
+    def forgetGrasps(self, object_name):
+        keys = self.graspCacheKeys(object_name)
+        if keys is not None:
+            self.grasp_cache.markFailed(keys[0], keys[1], self.ez_objects[object_name][1])
+
     # Shortcut of movegroup's attach_object
     def attachThis(self, object_name):
-        touch_links = self.robot_commander.get_link_names(self.gripper_move_group_name)
-        self.arm_move_group.attach_object(object_name, link_name=self.arm_move_group.get_end_effector_link(), touch_links=touch_links)
+        self.arm_move_group.attach_object(object_name, link_name=self.endEffectorLink(), touch_links=self.gripperLinks())
 
     # Shortcut of movegroup's detach_object
     def detachThis(self, object_name):
         self.arm_move_group.detach_object(object_name)
 
+    # Wait for the joints of the specified move group to stop moving
+    def settle(self, stage, move_group):
+        with self.stats.span("settle_" + stage):
+            if self.settle_detector is None:
+                time.sleep(1)
+                return
+            self.settle_detector.waitForStill(stage, move_group.get_active_joints())
+
+    # Wait for the specified object to be attached in the planning scene
+    def settleAttached(self, stage, object_name):
+        with self.stats.span("settle_" + stage):
+            if self.settle_detector is None:
+                time.sleep(1)
+                return
+            self.settle_detector.waitForAttached(stage, self.moveit_scene, object_name)
+
+    # Report the progress of the request, see progress_cb
+    def progress(self, stage, count=0):
+        if self.progress_cb is not None:
+            self.progress_cb(stage, count)
+
+    # Check if the request has been preempted, see preempt_check.
+    # While the object is in the gripper, the request is never preempted,
+    # so that it is placed instead of being left attached to the arm
+    def preempted(self):
+        return not self.holding and self.preempt_check is not None and self.preempt_check()
+
     # Pick and place!
-    def uberPlan(self):
-        return self.pick() and self.place()
+    def uberPlan(self, valid_grasps=None):
+        with self.stats.span("pick"):
+            picked = self.pick(valid_grasps)
+        if not picked or self.preempted():
+            return False
+        with self.stats.span("place"):
+            return self.place()
 
     # Open the gripper, move the arm to the grasping pose
-    # and grab the object
-    def pick(self):
+    # and grab the object.
+    # Grasps are tried as soon as they are validated, so the remaining
+    # candidates are only evaluated if the first ones cannot be reached.
+    # Already validated grasps can be specified with valid_grasps
+    def pick(self, valid_grasps=None):
         if not self.already_picked:
             # GraspIt assumes maxed out joints, so that's what we do here
             self.openGripper()
-            time.sleep(1)
-            valid_g = self.discard(self.grasp_poses)
-
-            if len(valid_g) > 0:
-                for j in xrange(len(valid_g[0])):
+            self.settle("open_gripper", self.gripper_move_group)
+            found = 0
+            valid_g = iter(valid_grasps) if valid_grasps is not None else self.validGrasps(self.grasp_store)
+            try:
+                for pose, solution, posture in valid_g:
+                    if self.preempted():
+                        break
+                    found += 1
+                    self.progress("grasps_validated", found)
                     self.arm_move_group.set_start_state_to_current_state()
-                    if self.move(valid_g[0][j].pose):
-                        time.sleep(1)
-                        return self.grab(self.pose_n_joint[valid_g[0][j]])
+                    if self.move(pose.pose):
+                        self.settle("grasp_pose", self.arm_move_group)
+                        picked = self.grab(posture)
+                        if picked:
+                            self.holding = True
+                            self.progress("picked")
+                        else:
+                            self.rememberFailure(self.object_to_grasp, "grasp", pose)
+                        return picked
+                    self.rememberFailure(self.object_to_grasp, "grasp", pose)
+            finally:
+                if valid_grasps is None:
+                    valid_g.close()
+            if self.preempted():
+                self.error_info = "Preempted"
+            elif found:
                 self.error_info = "Error while trying to pick the object!"
             else:
                 self.error_info = "No valid grasps were found!"
@@ -158,345 +320,482 @@ class EZToolSet():
         if not self.already_picked:
             self.attachThis(self.object_to_grasp)
             self.already_picked = True
-        time.sleep(1)
-        t, sol = self.calcTargetPose(obj_trans)
+        self.settleAttached("attach", self.object_to_grasp)
+        with self.stats.span("calc_target_pose"):
+            t, sol, placed = self.calcTargetPose(obj_trans)
         if t and sol:
+            self.progress("place_pose_found")
             if self.moveToState(sol) or self.move(t):
-                time.sleep(1)
+                self.settle("place_pose", self.arm_move_group)
                 self.openGripper()
                 self.detachThis(self.object_to_grasp)
+                self.holding = False
+                self.placedAt(placed)
+                self.progress("placed")
                 return True
+            self.rememberFailure(self.object_to_grasp, "place", t)
             self.error_info = "Error while trying to place the object!"
         else:
             self.error_info = "Error while trying to find a way to place the object!"
         return False
 
+    # Move the placed object to its new pose in the scene (graspit world, moveit scene,
+    # collision boxes) of the toolset that owns the session, like a scene update would
+    def placedAt(self, object_pose):
+        if self.object_to_grasp not in self.scene_models:
+            return
+        model = copy.copy(self.scene_models[self.object_to_grasp][1])
+        model.pose = object_pose
+        req = EzSceneUpdateRequest()
+        req.moved = [model]
+        res = (self.owner if self.owner is not None else self).sceneUpdate(req)
+        if isinstance(res, tuple) or not res.success:
+            print "placedAt: Could not move " + self.object_to_grasp + " in the scene"
+
     # Get the upper limit for each of the gripper's joints
     def getGripperBounds(self):
+        if self.commander_pool is not None:
+            self.gripper_joint_bounds = self.commander_pool.jointBounds(self.gripper_move_group_name)
+            return
         for joint in self.gripper_move_group.get_joints():
             self.gripper_joint_bounds[joint] = self.robot_commander.get_joint(joint).max_bound()
 
-    # Compute inverse kinematics for candidate poses
-    # and discard those without a solution
-    def discard(self, poses):
-        validp = []
-        validrs = []
+    # The end effector link of the arm
+    def endEffectorLink(self):
+        if self.commander_pool is not None:
+            return self.commander_pool.endEffectorLink(self.arm_move_group_name)
+        return self.arm_move_group.get_end_effector_link()
+
+    # The links of the gripper, which are allowed to touch an attached object
+    def gripperLinks(self):
+        if self.commander_pool is not None:
+            return self.commander_pool.linkNames(self.gripper_move_group_name)
+        return self.robot_commander.get_link_names(self.gripper_move_group_name)
+
+    # Joint name -> index in the specified joint name list
+    def jointIndex(self, names):
+        if self.commander_pool is not None:
+            return self.commander_pool.jointIndex(names)
+        return dict((names[i], i) for i in xrange(len(names)))
+
+    # Build an inverse kinematics request for the arm
+    def ikRequest(self, pose, robot_state):
         req = GetPositionIKRequest()
         req.ik_request.group_name = self.arm_move_group_name
-        req.ik_request.robot_state = self.robot_commander.get_current_state()
+        req.ik_request.robot_state = robot_state
         req.ik_request.avoid_collisions = True
+        req.ik_request.pose_stamped = pose
+        return req
+
+    # Build the ik requests of the specified poses. With ik seeds, each request is seeded
+    # with the solution of the nearest previously solved pose, if there is one close enough.
+    # Returns the requests and the names their ik calls are timed as (compute_ik or compute_ik_seeded).
+    # The ik cache is keyed on the unseeded robot_state, so seeding does not defeat it
+    def ikRequests(self, poses, robot_state):
+        reqs = []
+        spans = []
         for p in poses:
-            req.ik_request.pose_stamped = p
-            if self.debug:
-                br = tf.TransformBroadcaster()
-                br.sendTransform((p.pose.position.x, p.pose.position.y, p.pose.position.z), (p.pose.orientation.x, p.pose.orientation.y, p.pose.orientation.z, p.pose.orientation.w), rospy.Time.now(), "candidate_grasp_pose", p.header.frame_id)
-            k = self.compute_ik_srv(req)
-            if k.error_code.val == 1:
-                validp.append(p)
-                validrs.append(k.solution)
-        if validp:
-            return [validp, validrs]
-        return []
-
-    # The planning service callback
-    def startPlanning(self, req):
-        # Initialize moveit stuff
-        self.robot_commander = moveit_commander.RobotCommander()
-        self.arm_move_group = moveit_commander.MoveGroupCommander(req.arm_move_group)
-        self.gripper_move_group = moveit_commander.MoveGroupCommander(req.gripper_move_group)
-
+            state, seeded = robot_state, False
+            if self.ik_seeds is not None:
+                state, seeded = self.ik_seeds.seed(self.arm_move_group_name, p.header.frame_id, ez_transforms.poseToArray(p.pose), robot_state)
+            reqs.append(self.ikRequest(p, state))
+            spans.append("compute_ik_seeded" if seeded else "compute_ik")
+        return reqs, spans
+
+    # Count the outcome of an ik request (solved and timed out, seeded or not)
+    # and keep its solution as a seed for the next requests
+    def ikResult(self, req, span, response, arm_joints):
+        valid = validIK(response)
+        self.stats.ik(valid)
+        if valid:
+            self.stats.count(span + "_solved")
+            if self.ik_seeds is not None:
+                p = req.ik_request.pose_stamped
+                self.ik_seeds.add(self.arm_move_group_name, p.header.frame_id, ez_transforms.poseToArray(p.pose), response.solution, arm_joints)
+        elif response is not None and response.error_code.val == MoveItErrorCodes.TIMED_OUT:
+            self.stats.count(span + "_timed_out")
+        return valid
+
+    # Remember that the specified grasp or place PoseStamped failed for the object
+    def rememberFailure(self, object_name, kind, pose, ik=False):
+        if self.failure_memory is not None:
+            self.failure_memory.record(object_name, kind, pose.header.frame_id, ez_transforms.poseToArray(pose.pose), ik)
+
+    # The indices of the (N, 7) candidate poses in the order they should be tried, and the skipped indices.
+    # Remembered failures are tried last, and the ones that failed repeatedly not at all
+    def failureOrder(self, object_name, kind, frame_id, poses):
+        if self.failure_memory is None:
+            return numpy.arange(len(poses)), numpy.zeros(0, dtype=int)
+        order, skipped = self.failure_memory.order(object_name, kind, frame_id, poses)
+        self.stats.count(kind + "_failures_skipped", len(skipped))
+        return order, skipped
+
+    # Lazily validate the grasps of a grasp store, yielding (pose, ik_solution, grasp_posture)
+    # tuples in candidate order as soon as each one is found to have an ik solution.
+    # Grasps already found invalid are skipped, and the status of every evaluated grasp is stored.
+    # Closing the generator drops the candidates that have not been evaluated yet
+    def validGrasps(self, store):
+        curr_state = self.robot_commander.get_current_state()
+        self.dropUnreachable(store)
+        indices = store.candidates()
+        order, skipped = self.failureOrder(store.object_name, "grasp", store.frame_id, store.poses[indices])
+        store.setStatus(indices[skipped], INVALID)
+        indices = indices[order]
+        poses = [store.poseStamped(i) for i in indices]
+        reqs, spans = self.ikRequests(poses, curr_state)
+        arm_joints = self.arm_move_group.get_active_joints()
+        results = self.ik_pool.iterate(reqs, self.stats, spans, curr_state)
+        try:
+            for i, k in results:
+                p = poses[i]
+                if self.debug:
+                    br = tf.TransformBroadcaster()
+                    br.sendTransform((p.pose.position.x, p.pose.position.y, p.pose.position.z), (p.pose.orientation.x, p.pose.orientation.y, p.pose.orientation.z, p.pose.orientation.w), rospy.Time.now(), "candidate_grasp_pose", p.header.frame_id)
+                valid = self.ikResult(reqs[i], spans[i], k, arm_joints)
+                store.setStatus(indices[i], VALID if valid else INVALID)
+                if not valid:
+                    self.rememberFailure(store.object_name, "grasp", p, True)
+                # Stop between ik calls if the request has been preempted
+                if self.preempted():
+                    return
+                if valid:
+                    yield p, k.solution, store.posture(indices[i])
+        finally:
+            results.close()
+
+    # Mark the grasps that the reachability map rules out as invalid
+    def dropUnreachable(self, store):
+        if self.reachability_map is None:
+            return
+        indices = store.candidates()
+        unreachable = indices[~self.reachability_map.reachable(store.poses[indices], store.frame_id, self.reachability_min_score)]
+        store.setStatus(unreachable, INVALID)
+        self.stats.count("reachability_dropped", len(unreachable))
+
+    # Initialize moveit stuff for the specified move groups.
+    # With a commander pool, the commanders of previous requests are reused
+    def initMoveIt(self, arm_move_group, gripper_move_group):
+        with self.stats.span("init_moveit"):
+            if self.commander_pool is not None:
+                # Seeds of another robot would only slow ik down
+                if self.commander_pool.refresh() and self.ik_seeds is not None:
+                    self.ik_seeds.clear()
+                self.robot_commander = self.commander_pool.robot()
+                self.arm_move_group = self.commander_pool.group(arm_move_group)
+                self.gripper_move_group = self.commander_pool.group(gripper_move_group)
+            else:
+                self.robot_commander = moveit_commander.RobotCommander()
+                self.arm_move_group = moveit_commander.MoveGroupCommander(arm_move_group)
+                self.gripper_move_group = moveit_commander.MoveGroupCommander(gripper_move_group)
+            self.arm_move_group_name = arm_move_group
+            self.gripper_move_group_name = gripper_move_group
+
+            # Get bounds for each gipper joint, so we can later use the graspit values
+            self.getGripperBounds()
+
+    # Pick the specified object and place it to the specified place, replanning if needed.
+    # If the grasps of the object have already been planned and validated
+    # (see prepareJob), the first try uses them instead of calling graspit
+    def planAndExecute(self, object_name, target_place, max_replanning, prepared=None):
         # Save request values to use them later in the pipeline
-        self.arm_move_group_name = req.arm_move_group
-        self.object_to_grasp = req.graspit_target_object
-        self.gripper_move_group_name = req.gripper_move_group
-        self.target_place = req.target_place
-        self.replanning = req.max_replanning if req.max_replanning > 0 else 0
-
-        # Get bounds for each gipper joint, so we can later use the graspit values
-        self.getGripperBounds()
+        self.object_to_grasp = object_name
+        self.target_place = target_place
+        self.replanning = max_replanning if max_replanning > 0 else 0
+        self.already_picked = False
+        self.holding = False
 
         res = False
         while(self.replanning >= 0):
             self.error_info = ""
+            valid_grasps = None
             if not self.already_picked:
-                # Call graspit
-                graspit_grasps = self.graspThis(req.graspit_target_object)
-
-                # Generate grasp poses
-                self.translateGraspIt2MoveIt(graspit_grasps, req.graspit_target_object)
+                if prepared is not None:
+                    self.grasp_store, valid_grasps = prepared
+                    prepared = None
+                else:
+                    # Call graspit
+                    graspit_grasps = self.graspThis(object_name)
+
+                    # Generate grasp poses
+                    self.translateGraspIt2MoveIt(graspit_grasps, object_name)
+                self.progress("grasps_planned", len(self.grasp_store))
+
+            # The request is checked for preemption between stages (and between ik calls)
+            if self.preempted():
+                self.error_info = "Preempted"
+                break
 
-            res = self.uberPlan()
+            res = self.uberPlan(valid_grasps)
             self.replanning -= 1
+            if self.preempted() and not res:
+                # Nothing is wrong with the grasps, so keep them
+                self.error_info = "Preempted"
+                break
+            if not self.already_picked:
+                self.forgetGrasps(object_name)
             if res:
                 break
 
         return res, self.error_info
 
+    # Publish the stats of the last service call on the diagnostics topic
+    def publishStats(self, name, message=""):
+        if self.diagnostics_pub is not None and self.stats.enabled:
+            diagnostics = self.stats.diagnostics(name, message)
+            diagnostics.header.stamp = rospy.Time.now()
+            self.diagnostics_pub.publish(diagnostics)
+
+    # A copy of the toolset for a single planning request.
+    # The pools and the caches are shared with the toolset, the request state
+    # (target object, grasp poses, replanning...) is the session's own,
+    # so concurrent requests do not interfere, and the scene (models, their poses and graspit IDs,
+    # collision boxes) is a snapshot, so scene changes do not affect running requests.
+    # Must be called while holding scene_lock
+    def requestSession(self):
+        session = copy.copy(self)
+        session.owner = self
+        session.ez_objects = dict((name, list(entry)) for name, entry in self.ez_objects.items())
+        session.ez_obstacles = dict((name, list(entry)) for name, entry in self.ez_obstacles.items())
+        session.scene_models = dict((name, [kind, copy.copy(model)]) for name, (kind, model) in self.scene_models.items())
+        if self.collision_screen is not None:
+            session.collision_screen = copy.copy(self.collision_screen)
+        session.object_to_grasp = ""
+        session.target_place = None
+        session.grasp_store = None
+        session.gripper_joint_bounds = dict()
+        session.error_info = ""
+        session.replanning = 0
+        session.already_picked = False
+        session.holding = False
+        session.progress_cb = None
+        session.preempt_check = None
+        if self.stats.enabled:
+            session.stats = EZStats(True)
+        return session
+
+    # Run a planning request in a new session (see requestSession), as method(session).
+    # Waits only for requests of the same move groups, and for a running scene change.
+    # The scene is only locked while the session takes its snapshot, so scene changes
+    # never wait for planning and execution.
+    # If specified, setup(session) is called first, e.g. to set the session's hooks
+    def inSession(self, req, method, setup=None):
+        with self.group_locks.holding([req.arm_move_group, req.gripper_move_group]):
+            with self.scene_lock.reading():
+                session = self.requestSession()
+            if setup is not None:
+                setup(session)
+            return method(session)
+
+    # The planning service callback
+    def startPlanning(self, req):
+        return self.inSession(req, lambda session: session.planRequest(req))
+
+    # Plan and execute a single pick and place request.
+    # The response (an EzStartPlanning response unless specified) also holds
+    # the timings of the request's stages (if stats are enabled)
+    def planRequest(self, req, res=None):
+        self.stats.reset()
+        with self.stats.span("start_planning"):
+            self.initMoveIt(req.arm_move_group, req.gripper_move_group)
+            success, info = self.planAndExecute(req.graspit_target_object, req.target_place, req.max_replanning)
+        if res is None:
+            res = EzStartPlanningResponse()
+        res.success = success
+        res.info = info
+        self.stats.fill(res)
+        self.publishStats("start_planning", info)
+        return res
+
+    # Plan and validate the grasps of the specified object.
+    # Returns the grasp poses and the (pose, ik_solution, grasp_posture) tuples of the valid ones.
+    # Does not modify the current request's state, so it can run while another job executes
+    def prepareJob(self, object_name):
+        store = self.graspStore(self.graspThis(object_name), object_name)
+        return store, list(self.validGrasps(store))
+
+    # Run prepareJob in a background thread.
+    # Returns the thread and a dict that will hold the result under "prepared"
+    def prepareInBackground(self, object_name):
+        result = dict()
+        def work():
+            try:
+                result["prepared"] = self.prepareJob(object_name)
+            except Exception as e:
+                print "prepareJob:" + str(e)
+        t = threading.Thread(target=work, name="ez_prepare_" + object_name)
+        t.daemon = True
+        t.start()
+        return t, result
+
+    # The batch planning service callback
+    def startPlanningBatch(self, req):
+        return self.inSession(req, lambda session: session.planBatch(req))
+
+    # Plan and execute the jobs of a batch request.
+    # While job k executes, the grasps of job k+1 are planned, translated and validated
+    # in the background. Each job's result is published as soon as it finishes
+    def planBatch(self, req):
+        self.stats.reset()
+        self.initMoveIt(req.arm_move_group, req.gripper_move_group)
+
+        results = []
+        next_job = None
+        for i in xrange(len(req.jobs)):
+            job = req.jobs[i]
+            result = EzPlanningJobResult()
+            result.index = i
+            result.graspit_target_object = job.graspit_target_object
+            if job.graspit_target_object not in self.ez_objects:
+                result.success = False
+                result.info = "Unknown object: " + job.graspit_target_object
+            else:
+                if next_job is None:
+                    next_job = self.prepareInBackground(job.graspit_target_object)
+                t, prepared = next_job
+                t.join()
+                next_job = None
+                # Overlap the next job's grasp planning with this job's execution
+                for j in xrange(i + 1, len(req.jobs)):
+                    if req.jobs[j].graspit_target_object in self.ez_objects:
+                        next_job = self.prepareInBackground(req.jobs[j].graspit_target_object)
+                        break
+                result.success, result.info = self.planAndExecute(job.graspit_target_object, job.target_place, req.max_replanning, prepared.get("prepared"))
+            results.append(result)
+            if self.job_results_pub is not None:
+                self.job_results_pub.publish(result)
+        if next_job is not None:
+            next_job[0].join()
+
+        self.publishStats("start_planning_batch")
+        return [results]
+
     # Graspit bodies are always referenced relatively to the "world" frame,
     # and units are not expressed in meters so translate the user's input
     def fixItForGraspIt(self, obj, pose_factor):
-        for tryagain in xrange(0, 4):
-            p = Pose()
-            # If the user has provided the object wrt the world frame
-            if obj.pose.header.frame_id == "world":
-                p.position.x = obj.pose.pose.position.x * pose_factor
-                p.position.y = obj.pose.pose.position.y * pose_factor
-                p.position.z = obj.pose.pose.position.z * pose_factor
-                p.orientation.x = obj.pose.pose.orientation.x
-                p.orientation.y = obj.pose.pose.orientation.y
-                p.orientation.z = obj.pose.pose.orientation.z
-                p.orientation.w = obj.pose.pose.orientation.w
-                return p
-            # Else transform it to the world frame
-            else:
-                try:
-                    transform = TransformStamped()
-                    transform.header.stamp = rospy.Time.now()
-                    transform.header.frame_id = obj.pose.header.frame_id
-                    transform.child_frame_id = "ez_fix_it_for_grasp_it"
-                    transform.transform.translation.x = obj.pose.pose.position.x
-                    transform.transform.translation.y = obj.pose.pose.position.y
-                    transform.transform.translation.z = obj.pose.pose.position.z
-                    transform.transform.rotation.x = obj.pose.pose.orientation.x
-                    transform.transform.rotation.y = obj.pose.pose.orientation.y
-                    transform.transform.rotation.z = obj.pose.pose.orientation.z
-                    transform.transform.rotation.w = obj.pose.pose.orientation.w
-                    self.tf2_buffer.set_transform(transform, "fixItForGraspIt")
-
-                    trans = self.lookupTF("ez_fix_it_for_grasp_it", "world")
-
-                    p.position.x = trans.transform.translation.x * pose_factor
-                    p.position.y = trans.transform.translation.y * pose_factor
-                    p.position.z = trans.transform.translation.z * pose_factor
-                    p.orientation.x = trans.transform.rotation.x
-                    p.orientation.y = trans.transform.rotation.y
-                    p.orientation.z = trans.transform.rotation.z
-                    p.orientation.w = trans.transform.rotation.w
-                    return p
-                except Exception as e:
-                    print "fixItForGraspIt" + str(e)
-        return None
+        pose = ez_transforms.poseToArray(obj.pose.pose)
+        # Unless the user has provided the object wrt the world frame, transform it to the world frame.
+        # Computed in closed form, so that concurrent calls do not share any tf frame
+        if obj.pose.header.frame_id != "world":
+            trans = self.lookupTFRetry(obj.pose.header.frame_id, "world", "fixItForGraspIt")
+            if trans is None:
+                return None
+            # The world wrt the object, same as looking up "world" from a helper frame at the object
+            pose = ez_transforms.composePoses(ez_transforms.invertPose(pose), ez_transforms.transformToArray(trans.transform))
+        pose[:3] *= pose_factor
+        return ez_transforms.arrayToPose(pose, Pose())
 
     # GraspIt and MoveIt appear to have a 90 degree difference in the x axis (roll 90 degrees),
-    # so translate everything for moveit compatibility
+    # so translate everything for moveit compatibility.
+    # All grasps are translated in one batch, the tf buffer is only used
+    # for the constant end effector -> gripper frame transformation
     def translateGraspIt2MoveIt(self, grasps, object_name):
-        for tryagain in xrange(0,4):
-            self.grasp_poses = []
-            for g in grasps:
-                try:
-                    # World -> Object
-                    transform = TransformStamped()
-                    #transform.header.stamp = rospy.Time.now()
-                    transform.header.frame_id = "world"
-                    transform.child_frame_id = "target_object_frame"
-                    transform.transform.translation.x = self.ez_objects[object_name][1].pose.position.x
-                    transform.transform.translation.y = self.ez_objects[object_name][1].pose.position.y
-                    transform.transform.translation.z = self.ez_objects[object_name][1].pose.position.z
-                    transform.transform.rotation.x = self.ez_objects[object_name][1].pose.orientation.x
-                    transform.transform.rotation.y = self.ez_objects[object_name][1].pose.orientation.y
-                    transform.transform.rotation.z = self.ez_objects[object_name][1].pose.orientation.z
-                    transform.transform.rotation.w = self.ez_objects[object_name][1].pose.orientation.w
-                    self.tf2_buffer.set_transform(transform, "ez_helper")
-
-                    # Object -> Gripper
-                    transform = TransformStamped()
-                    #transform.header.stamp = rospy.Time.now()
-                    transform.header.frame_id = "target_object_frame"
-                    transform.child_frame_id = "ez_helper_graspit_pose"
-                    transform.transform.translation.x = g.grasp_pose.pose.position.x
-                    transform.transform.translation.y = g.grasp_pose.pose.position.y
-                    transform.transform.translation.z = g.grasp_pose.pose.position.z
-                    transform.transform.rotation.x = g.grasp_pose.pose.orientation.x
-                    transform.transform.rotation.y = g.grasp_pose.pose.orientation.y
-                    transform.transform.rotation.z = g.grasp_pose.pose.orientation.z
-                    transform.transform.rotation.w = g.grasp_pose.pose.orientation.w
-                    self.tf2_buffer.set_transform(transform, "ez_helper")
-
-                    transform_frame_gripper_trans = self.lookupTF(self.arm_move_group.get_end_effector_link(), self.gripper_frame)
-
-                    # Gripper -> End Effector
-                    transform = TransformStamped()
-                    #transform.header.stamp = rospy.Time.now()
-                    transform.header.frame_id = "ez_helper_graspit_pose"
-                    transform.child_frame_id = "ez_helper_fixed_graspit_pose"
-                    transform.transform.translation.x = -transform_frame_gripper_trans.transform.translation.x
-                    transform.transform.translation.y = -transform_frame_gripper_trans.transform.translation.y
-                    transform.transform.translation.z = -transform_frame_gripper_trans.transform.translation.z
-                    transform.transform.rotation.x = transform_frame_gripper_trans.transform.rotation.x
-                    transform.transform.rotation.y = transform_frame_gripper_trans.transform.rotation.y
-                    transform.transform.rotation.z = transform_frame_gripper_trans.transform.rotation.z
-                    transform.transform.rotation.w = transform_frame_gripper_trans.transform.rotation.w
-                    self.tf2_buffer.set_transform(transform, "ez_helper")
-
-                    # Graspit to MoveIt translation
-                    # (End Effector -> End Effector)
-                    graspit_moveit_transform = TransformStamped()
-                    #graspit_moveit_transform.header.stamp = rospy.Time.now()
-                    graspit_moveit_transform.header.frame_id = "ez_helper_fixed_graspit_pose"
-                    graspit_moveit_transform.child_frame_id = "ez_helper_target_graspit_pose"
-                    graspit_moveit_transform.transform.rotation.x = 0.7071
-                    graspit_moveit_transform.transform.rotation.y = 0.0
-                    graspit_moveit_transform.transform.rotation.z = 0.0
-                    graspit_moveit_transform.transform.rotation.w = 0.7071
-                    self.tf2_buffer.set_transform(graspit_moveit_transform, "ez_helper")
-
-                    target_trans = self.lookupTF("world", "ez_helper_target_graspit_pose")
-
-                    # World -> End Effector
-                    res_pose = PoseStamped()
-                    res_pose.header.frame_id = "world"
-                    #res_pose.header.stamp = rospy.Time.now()
-                    res_pose.pose.position.x = target_trans.transform.translation.x
-                    res_pose.pose.position.y = target_trans.transform.translation.y
-                    res_pose.pose.position.z = target_trans.transform.translation.z
-                    res_pose.pose.orientation.x = target_trans.transform.rotation.x
-                    res_pose.pose.orientation.y = target_trans.transform.rotation.y
-                    res_pose.pose.orientation.z = target_trans.transform.rotation.z
-                    res_pose.pose.orientation.w = target_trans.transform.rotation.w
-                    self.grasp_poses.append(res_pose)
-                    self.pose_n_joint[res_pose] = g.grasp_posture
-                except Exception as e:
-                    self.grasp_poses = []
-                    print "translateGraspIt2MoveIt:" + str(e)
-                    break
-
-    # Calculate the distance between two transformations in 2D (excluding the Z axis)
+        self.grasp_store = self.graspStore(grasps, object_name)
+
+    # A grasp store with the world frame end effector poses of the specified grasps.
+    # Does not modify the current request's state, so it is safe to run in the background
+    def graspStore(self, grasps, object_name):
+        ee_gripper_trans = self.lookupTFRetry(self.endEffectorLink(), self.gripper_frame, "translateGraspIt2MoveIt")
+        if ee_gripper_trans is None:
+            return EZGraspStore.fromGrasps([], numpy.zeros((0, 7)), "world", object_name)
+
+        with self.stats.span("translate_grasps"):
+            object_pose = ez_transforms.poseToArray(self.ez_objects[object_name][1].pose)
+            graspit_poses = ez_transforms.posesToArray([g.grasp_pose.pose for g in grasps])
+            ee_gripper = ez_transforms.transformToArray(ee_gripper_trans.transform)
+            # World -> End Effector
+            ee_poses = ez_transforms.graspIt2MoveIt(object_pose, graspit_poses, ee_gripper)
+            return EZGraspStore.fromGrasps(grasps, ee_poses, "world", object_name)
+
+    # Calculate the distance between two poses in 2D (excluding the Z axis)
     def distanceXY(self, pose1, pose2):
-        return sqrt((pose1.transform.translation.x**2 - pose2.transform.translation.x**2) + (pose1.transform.translation.y**2 - pose2.transform.translation.y**2))
-
-    # Use atan2 and quaternion multiplication to "look at" the specified center
-    # based on a specified current pose
-    def lookAt(self, curr_quat, center, p):
-        dx = p[0] - center[0]
-        dy = p[1] - center[1]
-        yaw = atan2(dy, dx)
-        quat = quaternion_from_euler(0, 0, yaw)
-        quat_start = [curr_quat.x, curr_quat.y, curr_quat.z, curr_quat.w]
-        return list(quaternion_multiply(quat, quat_start))
-
-    # Based on the specified object transformation, find poses in a circle
+        return sqrt((pose1[0] - pose2[0])**2 + (pose1[1] - pose2[1])**2)
+
+    # Based on the specified object pose, find poses in a circle
     # with the object as the center, that maintain the object's pitch and roll rotations
-    # utilizing the lookAt function
-    def gyrate(self, object_trans, curr_trans, step):
-        center = [object_trans.transform.translation.x, object_trans.transform.translation.y]
-        poses = []
-        radius = self.distanceXY(object_trans, curr_trans)
-        radius2 = radius**2
-        # Calculate only for one quadrant of the circle
-        for x in numpy.arange(center[0]-radius, center[0]+radius, step):
-            for y in numpy.arange(center[1]-radius, center[1]+radius, step):
-                x_center = x - center[0]
-                y_center = y - center[1]
-                if (x_center**2 + y_center**2) <= radius2:
-                    x_ = center[0] - x_center
-                    y_ = center[1] - y_center
-                    new_quat = self.lookAt(curr_trans.transform.rotation, center, [x, y])
-                    poses.append([[x, y],new_quat])
-                    new_quat = self.lookAt(curr_trans.transform.rotation, center, [x_, y])
-                    poses.append([[x_, y],new_quat])
-                    new_quat = self.lookAt(curr_trans.transform.rotation, center, [x, y_])
-                    poses.append([[x, y_],new_quat])
-                    new_quat = self.lookAt(curr_trans.transform.rotation, center, [x_, y_])
-                    poses.append([[x_, y_],new_quat])
-        return poses
-
-    # Calculate the place pose of the end effector, based on the picked object's pose
+    # and "look at" the center. Returns an (N, 7) array of [x, y, z, qx, qy, qz, qw] rows
+    def gyrate(self, object_pose, curr_pose, step):
+        radius = self.distanceXY(object_pose, curr_pose)
+        return ez_transforms.gyrate(object_pose[:2], radius, curr_pose[3:], step, curr_pose[2])
+
+    # Calculate the place pose of the end effector, based on the picked object's pose.
+    # Returns the place pose, its ik solution and the object's PoseStamped once placed there
     def calcTargetPose(self, obj_trans):
-        for tryagain in xrange(0,4):
-            try:
+        place_frame = self.target_place.header.frame_id
+        start_trans = self.lookupTFRetry(place_frame, self.endEffectorLink(), "calcTargetPose")
+        if start_trans is None:
+            return None, None, None
+        start_pose = ez_transforms.transformToArray(start_trans.transform)
+
+        # Express the picked object wrt the place frame
+        object_pose = ez_transforms.poseToArray(obj_trans[self.object_to_grasp])
+        if place_frame != "world":
+            world_trans = self.lookupTFRetry(place_frame, "world", "calcTargetPose")
+            if world_trans is None:
+                return None, None, None
+            object_pose = ez_transforms.composePoses(ez_transforms.transformToArray(world_trans.transform), object_pose)
+
+        # carried is the object wrt the end effector, it is carried along with this grasp offset
+        target_position = ez_transforms.poseToArray(self.target_place.pose)[:3]
+        target_object_pose, carried = ez_transforms.placePose(object_pose, target_position, start_pose)
 
-                start_trans = self.lookupTF(self.target_place.header.frame_id, self.arm_move_group.get_end_effector_link())
-
-                obj = TransformStamped()
-                #obj.header.stamp = rospy.Time.now()
-                obj.header.frame_id = "world"
-                obj.child_frame_id = "ez_target_pick_world"
-                obj.transform.translation.x = obj_trans[self.object_to_grasp].position.x
-                obj.transform.translation.y = obj_trans[self.object_to_grasp].position.y
-                obj.transform.translation.z = obj_trans[self.object_to_grasp].position.z
-                obj.transform.rotation.x = obj_trans[self.object_to_grasp].orientation.x
-                obj.transform.rotation.y = obj_trans[self.object_to_grasp].orientation.y
-                obj.transform.rotation.z = obj_trans[self.object_to_grasp].orientation.z
-                obj.transform.rotation.w = obj_trans[self.object_to_grasp].orientation.w
-                self.tf2_buffer.set_transform(obj, "calcTargetPose")
-
-                pick_to_target_frame_trans = self.lookupTF(self.target_place.header.frame_id, "ez_target_pick_world")
-
-                ptt = TransformStamped()
-                ptt.header.stamp = rospy.Time.now()
-                ptt.header.frame_id = self.target_place.header.frame_id
-                ptt.child_frame_id = "ez_target_pick"
-                ptt.transform.translation.x = pick_to_target_frame_trans.transform.translation.x
-                ptt.transform.translation.y = pick_to_target_frame_trans.transform.translation.y
-                ptt.transform.translation.z = pick_to_target_frame_trans.transform.translation.z
-                ptt.transform.rotation.x = pick_to_target_frame_trans.transform.rotation.x
-                ptt.transform.rotation.y = pick_to_target_frame_trans.transform.rotation.y
-                ptt.transform.rotation.z = pick_to_target_frame_trans.transform.rotation.z
-                ptt.transform.rotation.w = pick_to_target_frame_trans.transform.rotation.w
-                self.tf2_buffer.set_transform(ptt, "calcTargetPose")
-
-                trans1 = self.lookupTF("ez_target_pick", self.arm_move_group.get_end_effector_link())
-
-                target_trans = TransformStamped()
-                #target_trans.header.stamp = rospy.Time.now()
-                target_trans.header.frame_id = self.target_place.header.frame_id
-                target_trans.child_frame_id = "ez_target_place"
-                target_trans.transform.translation.x = self.target_place.pose.position.x
-                target_trans.transform.translation.y = self.target_place.pose.position.y
-                target_trans.transform.translation.z = self.target_place.pose.position.z
-                target_trans.transform.rotation.x = pick_to_target_frame_trans.transform.rotation.x
-                target_trans.transform.rotation.y = pick_to_target_frame_trans.transform.rotation.y
-                target_trans.transform.rotation.z = pick_to_target_frame_trans.transform.rotation.z
-                target_trans.transform.rotation.w = pick_to_target_frame_trans.transform.rotation.w
-                self.tf2_buffer.set_transform(target_trans, "calcTargetPose")
-
-                ee_target_trans = TransformStamped()
-                #ee_target_trans.header.stamp = rospy.Time.now()
-                ee_target_trans.header.frame_id = "ez_target_place"
-                ee_target_trans.child_frame_id = "ez_target_to_ee"
-                ee_target_trans.transform.translation.x = trans1.transform.translation.x
-                ee_target_trans.transform.translation.y = trans1.transform.translation.y
-                ee_target_trans.transform.translation.z = trans1.transform.translation.z
-                ee_target_trans.transform.rotation.x = trans1.transform.rotation.x
-                ee_target_trans.transform.rotation.y = trans1.transform.rotation.y
-                ee_target_trans.transform.rotation.z = trans1.transform.rotation.z
-                ee_target_trans.transform.rotation.w = trans1.transform.rotation.w
-                self.tf2_buffer.set_transform(ee_target_trans, "calcTargetPose")
-
-                trans2 = self.lookupTF(self.target_place.header.frame_id, "ez_target_to_ee")
-
-                target_pose = PoseStamped()
-                #target_pose.header.stamp = rospy.Time.now()
-                target_pose.header.frame_id = self.target_place.header.frame_id
-                target_pose.pose.position.z = start_trans.transform.translation.z
-
-                curr_state = self.robot_commander.get_current_state()
-                # get_current_state does not include the attached object, so we add it manually
-                attobj = self.moveit_scene.get_attached_objects([self.object_to_grasp])
-                curr_state.attached_collision_objects = [attobj[self.object_to_grasp]]
-                req = GetPositionIKRequest()
-                req.ik_request.group_name = self.arm_move_group_name
-                req.ik_request.robot_state = curr_state
-                req.ik_request.avoid_collisions = True
-
-                gyrated_poses = self.gyrate(target_trans, start_trans, 0.1)
-
-                for gp in gyrated_poses:
-                    for i in xrange(0,6):
-                        target_pose.pose.position.x = gp[0][0]
-                        target_pose.pose.position.y = gp[0][1]
-                        target_pose.pose.position.z = start_trans.transform.translation.z + i * 0.01
-                        target_pose.pose.orientation.x = gp[1][0]
-                        target_pose.pose.orientation.y = gp[1][1]
-                        target_pose.pose.orientation.z = gp[1][2]
-                        target_pose.pose.orientation.w = gp[1][3]
-                        req.ik_request.pose_stamped = target_pose
-                        k = self.compute_ik_srv(req)
-                        if k.error_code.val == 1:
-                            return target_pose, k.solution
-            except Exception as e:
-                print "calcTargetPose" + str(e)
-        return None, None
+        try:
+            curr_state = self.robot_commander.get_current_state()
+            # get_current_state does not include the attached object, so we add it manually
+            attobj = self.moveit_scene.get_attached_objects([self.object_to_grasp])
+            curr_state.attached_collision_objects = [attobj[self.object_to_grasp]]
+
+            gyrated_poses = self.gyrate(target_object_pose, start_pose, 0.1)
+            arm_joints = self.arm_move_group.get_active_joints()
+
+            # Every gyrated pose is tried in a series of heights
+            candidates = numpy.repeat(gyrated_poses, 6, axis=0)
+            candidates[:, 2] += numpy.tile(numpy.arange(6) * 0.01, len(gyrated_poses))
+
+            # The ones that put the object closest to the place position first,
+            # the cheapest motion first among equally close ones
+            candidates = candidates[ez_transforms.rankPlaceCandidates(candidates, carried, target_position, start_pose, self.place_yaw_weight)]
+
+            if self.reachability_map is not None:
+                reachable = self.reachability_map.reachable(candidates, place_frame, self.reachability_min_score)
+                self.stats.count("reachability_dropped", len(candidates) - numpy.count_nonzero(reachable))
+                candidates = candidates[reachable]
+
+            # Drop the candidates that would put the object inside another model.
+            # Candidates are end effector poses, so the object is carried along with the grasp offset
+            if self.collision_screen is not None and self.object_to_grasp in self.scene_models:
+                free = self.collision_screen.free(self.scene_models[self.object_to_grasp][1], ez_transforms.composePoses(candidates, carried), place_frame)
+                self.stats.count("collision_dropped", len(candidates) - numpy.count_nonzero(free))
+                candidates = candidates[free]
+
+            # Places that failed before are tried last
+            order, _ = self.failureOrder(self.object_to_grasp, "place", place_frame, candidates)
+            candidates = candidates[order]
+
+            # Only the first (in cost order) solution is needed, so candidates
+            # are handed to the ik pool in small batches
+            for first in xrange(0, len(candidates), self.place_batch_size):
+                if self.preempted():
+                    break
+                target_poses = []
+                for c in candidates[first:first + self.place_batch_size]:
+                    target_pose = PoseStamped()
+                    target_pose.header.frame_id = place_frame
+                    ez_transforms.arrayToPose(c, target_pose.pose)
+                    target_poses.append(target_pose)
+                reqs, spans = self.ikRequests(target_poses, curr_state)
+                responses = self.ik_pool.evaluate(reqs, 1, self.stats, spans, curr_state)
+                for i in xrange(len(responses)):
+                    if not self.ikResult(reqs[i], spans[i], responses[i], arm_joints):
+                        self.rememberFailure(self.object_to_grasp, "place", target_poses[i], True)
+                if responses and validIK(responses[-1]):
+                    target_pose = target_poses[len(responses) - 1]
+                    placed = PoseStamped()
+                    placed.header.frame_id = place_frame
+                    ez_transforms.arrayToPose(ez_transforms.composePoses(ez_transforms.poseToArray(target_pose.pose), carried), placed.pose)
+                    return target_pose, responses[-1].solution, placed
+        except Exception as e:
+            print "calcTargetPose" + str(e)
+        return None, None, None
 
     # Check if the input of the scene setup service is valid
     def validSceneSetupInput(self, req):
@@ -562,8 +861,158 @@ class EZToolSet():
                 return False, info, error_codes
         return True, info, error_codes
 
-    # The scene setup service callback
+    # Add a model to the graspit database, unless an identical one has already been added.
+    # Returns the model's ID (None on failure), whether it was already known, and the error code
+    def addToGraspItDatabase(self, atd, kind, fresh=False):
+        if self.model_registry is not None and not fresh:
+            model_id = self.model_registry.graspitID(atd.modelName, atd.filename, kind)
+            if model_id is not None:
+                return model_id, True, None
+        with self.stats.span("graspit_add_to_database"):
+            response = self.add_model_srv(atd)
+        if response.returnCode != response.SUCCESS:
+            return None, False, response.returnCode
+        if self.model_registry is not None:
+            self.model_registry.rememberGraspitID(atd.modelName, atd.filename, kind, response.modelID)
+        return response.modelID, False, None
+
+    # Add a model to the graspit database (if needed) and load it to the graspit world.
+    # If a model ID remembered from a previous setup cannot be loaded (e.g. graspit was restarted),
+    # the model is added to the database again
+    def loadModelToGraspIt(self, atd, kind, model_pose):
+        model_id, known, error = self.addToGraspItDatabase(atd, kind)
+        if model_id is None:
+            return None, None, error
+        loadm = LoadDatabaseModelRequest()
+        loadm.model_id = model_id
+        loadm.model_pose = model_pose
+        with self.stats.span("graspit_load_model"):
+            response = self.load_model_srv(loadm)
+        if response.result != response.LOAD_SUCCESS and known:
+            # The remembered ID might be stale, so add the model again
+            model_id, known, error = self.addToGraspItDatabase(atd, kind, True)
+            if model_id is None:
+                return None, None, error
+            loadm.model_id = model_id
+            with self.stats.span("graspit_load_model"):
+                response = self.load_model_srv(loadm)
+        return model_id, response.result, None
+
+    # Add a model to the graspit database and load it to the graspit world.
+    # Returns the model's ID (None if it could not be added to the database),
+    # and the info and error codes of any failure
+    def loadToGraspIt(self, model, kind):
+        info = []
+        error_codes = []
+        atd = AddToDatabaseRequest()
+        atd.filename = model.graspit_file
+        atd.isRobot = False
+        atd.asGraspable = kind == "object"
+        atd.modelName = model.name
+        model_id, result, error = self.loadModelToGraspIt(atd, kind, self.fixItForGraspIt(model, self.pose_factor))
+        if model_id is None:
+            info.append("Error adding " + kind + " " + model.name + " to graspit database")
+            error_codes.append(error)
+        elif result != LoadDatabaseModelResponse.LOAD_SUCCESS:
+            info.append("Error loading " + kind + " " + model.name + " to graspit world")
+            error_codes.append(result)
+        return model_id, info, error_codes
+
+    # Add the gripper to the graspit database and load it to the graspit world,
+    # at the current pose of the gripper frame
+    def loadGripperToGraspIt(self, gripper, finger_joint_names):
+        info = []
+        error_codes = []
+        atd = AddToDatabaseRequest()
+        atd.filename = gripper.graspit_file
+        atd.isRobot = True
+        atd.asGraspable = False
+        atd.modelName = gripper.name
+        atd.jointNames = finger_joint_names
+
+        p = Pose()
+
+        gripper_trans = self.lookupTF(self.gripper_frame, "world")
+
+        p.position.x = gripper_trans.transform.translation.x * self.pose_factor
+        p.position.y = gripper_trans.transform.translation.y * self.pose_factor
+        p.position.z = gripper_trans.transform.translation.z * self.pose_factor
+
+        robot_id, result, error = self.loadModelToGraspIt(atd, "robot", p)
+        if robot_id is None:
+            info.append("Error adding robot " + gripper.name + " to graspit database")
+            error_codes.append(error)
+        elif result != LoadDatabaseModelResponse.LOAD_SUCCESS:
+            info.append("Error loading robot " + gripper.name + " to graspit world")
+            error_codes.append(result)
+        return robot_id, info, error_codes
+
+    # Add the specified models to the moveit scene.
+    # Models with an STL moveit file are sent in a single planning scene diff,
+    # any other format is added one by one through the planning scene interface.
+    # Meshes that are already in the scene are only moved
+    def addToMoveIt(self, models):
+        scene = PlanningScene()
+        scene.is_diff = True
+        known = None
+        for model in models:
+            if model.moveit_file == "":
+                continue
+            co = CollisionObject()
+            co.id = model.name
+            co.header = model.pose.header
+            co.mesh_poses = [model.pose.pose]
+            if self.planning_scene_pub is not None and self.model_registry is not None and self.model_registry.inMoveIt(model.name, model.moveit_file):
+                # Someone else might have removed it from the moveit scene since
+                if known is None:
+                    known = set(self.moveit_scene.get_known_object_names())
+                if model.name in known:
+                    co.operation = co.MOVE
+                    scene.world.collision_objects.append(co)
+                    continue
+                self.model_registry.forgetMoveIt(model.name)
+            if self.planning_scene_pub is None or not ez_mesh.isSTL(model.moveit_file):
+                self.moveit_scene.add_mesh(model.name, model.pose, model.moveit_file)
+            else:
+                if self.model_registry is not None:
+                    co.meshes = [self.model_registry.mesh(model.moveit_file)]
+                else:
+                    co.meshes = [ez_mesh.toMeshMsg(*ez_mesh.loadSTL(model.moveit_file))]
+                co.operation = co.ADD
+                scene.world.collision_objects.append(co)
+            if self.model_registry is not None:
+                self.model_registry.rememberMoveIt(model.name, model.moveit_file)
+        if scene.world.collision_objects:
+            with self.stats.span("moveit_scene_diff"):
+                self.planning_scene_pub.publish(scene)
+
+    # Run loadToGraspIt concurrently (on the specified thread pool) for the objects and obstacles
+    # that have a graspit file, and keep the ones that made it to the graspit database.
+    # Returns the info and error codes of any failure, in the same order as the models
+    def loadAllToGraspIt(self, pool, objects, obstacles):
+        jobs = [(obj, "object") for obj in objects if obj.graspit_file != ""]
+        jobs += [(obstacle, "obstacle") for obstacle in obstacles if obstacle.graspit_file != ""]
+        results = pool.map(lambda job: self.loadToGraspIt(job[0], job[1]), jobs)
+        info = []
+        error_codes = []
+        for (model, kind), (model_id, model_info, model_ec) in zip(jobs, results):
+            if model_id is not None:
+                if kind == "object":
+                    self.ez_objects[model.name] = [model_id, model.pose]
+                else:
+                    self.ez_obstacles[model.name] = [model_id, model.pose]
+            info += model_info
+            error_codes += model_ec
+        return info, error_codes
+
+    # The scene setup service callback, waits only while a planning request snapshots the scene
     def sceneSetup(self, req):
+        with self.scene_lock.writing():
+            return self.setupScene(req)
+
+    # The graspit database/world chains of all models run concurrently,
+    # and the moveit scene is updated in one go
+    def setupScene(self, req):
         self.pose_factor = req.pose_factor if req.pose_factor > 0 else self.pose_factor
 
         valid, info, ec = self.validSceneSetupInput(req)
@@ -573,114 +1022,310 @@ class EZToolSet():
         if not valid:
             return valid, info, ec
 
+        self.stats.reset()
+
         res = EzSceneSetupResponse()
         res.success = True
 
+        # The world is about to change, so previous ik results (and failures) are no longer valid
+        if self.ik_cache is not None:
+            self.ik_cache.invalidate()
+        if self.failure_memory is not None:
+            self.failure_memory.forget()
+
+        pool = ThreadPool(max(1, self.scene_workers))
         try:
+            # ------ Graspit world ------
+            gripper_result = pool.apply_async(self.loadGripperToGraspIt, (req.gripper, req.finger_joint_names))
+            res.info, res.error_codes = self.loadAllToGraspIt(pool, req.objects, req.obstacles)
+            self.gripper_id, gripper_info, gripper_ec = gripper_result.get()
+            if self.gripper_id is not None:
+                self.gripper_name = req.gripper.name
+                self.gripper_file = req.gripper.graspit_file
+            res.info += gripper_info
+            res.error_codes += gripper_ec
+            res.success = len(res.info) == 0
+            # ---------------------------
+
+            # ------ Moveit scene -------
+            self.addToMoveIt(list(req.objects) + list(req.obstacles))
+            # ---------------------------
+
             for obj in req.objects:
-                # ------ Graspit world ------
-                if obj.graspit_file != "":
-                    atd = AddToDatabaseRequest()
-                    atd.filename = obj.graspit_file
-                    atd.isRobot = False
-                    atd.asGraspable = True
-                    atd.modelName = obj.name
-                    response = self.add_model_srv(atd)
-                    if response.returnCode != response.SUCCESS:
-                        res.success = False
-                        res.info.append("Error adding object " + obj.name + " to graspit database")
-                        res.error_codes.append(response.returnCode)
-                    else:
-                        objectID = response.modelID
-
-                        loadm = LoadDatabaseModelRequest()
-                        loadm.model_id = objectID
-                        loadm.model_pose = self.fixItForGraspIt(obj, self.pose_factor)
-                        response = self.load_model_srv(loadm)
-
-                        self.ez_objects[obj.name] = [objectID, obj.pose]
-
-                        if response.result != response.LOAD_SUCCESS:
-                            res.success = False
-                            res.info.append("Error loading object " + obj.name + " to graspit world")
-                            res.error_codes.append(response.result)
-                # ---------------------------
-
-                # ------ Moveit scene -------
-                if obj.moveit_file != "":
-                    self.moveit_scene.add_mesh(obj.name, obj.pose, obj.moveit_file)
-                # ---------------------------
+                self.scene_models[obj.name] = ["object", obj]
             for obstacle in req.obstacles:
-                # ------ Graspit world ------
-                if obstacle.graspit_file != "":
-                    atd = AddToDatabaseRequest()
-                    atd.filename = obstacle.graspit_file
-                    atd.isRobot = False
-                    atd.asGraspable = False
-                    atd.modelName = obstacle.name
-                    response = self.add_model_srv(atd)
-                    if response.returnCode != response.SUCCESS:
-                        res.success = False
-                        res.info.append("Error adding obstacle " + obstacle.name + " to graspit database")
-                        res.error_codes.append(response.returnCode)
-                    else:
-                        obstacleID = response.modelID
-
-                        loadm = LoadDatabaseModelRequest()
-                        loadm.model_id = obstacleID
-                        loadm.model_pose = self.fixItForGraspIt(obstacle, self.pose_factor)
-                        response = self.load_model_srv(loadm)
-
-                        self.ez_obstacles[obstacle.name] = [obstacleID, obstacle.pose]
-
-                        if response.result != response.LOAD_SUCCESS:
-                            res.success = False
-                            res.info.append("Error loading obstacle " + obstacle.name + " to graspit world")
-                            res.error_codes.append(response.result)
-                # ---------------------------
-
-                # ------ Moveit scene -------
-                if obstacle.moveit_file != "":
-                    self.moveit_scene.add_mesh(obstacle.name, obstacle.pose, obstacle.moveit_file)
-                # ---------------------------
+                self.scene_models[obstacle.name] = ["obstacle", obstacle]
 
-            # ------ Graspit world ------
-            atd = AddToDatabaseRequest()
-            atd.filename = req.gripper.graspit_file
-            atd.isRobot = True
-            atd.asGraspable = False
-            atd.modelName = req.gripper.name
-            atd.jointNames = req.finger_joint_names
-            response = self.add_model_srv(atd)
-            if response.returnCode != response.SUCCESS:
-                    res.success = False
-                    res.info.append("Error adding robot " + req.gripper.name + " to graspit database")
-                    res.error_codes.append(response.returnCode)
+            if self.model_registry is not None:
+                rospy.logdebug("ez_pnp model registry: " + str(self.model_registry.stats()))
+
+            self.updateCollisionScreen()
+            self.saveSession()
+
+            return res
+
+        except Exception as e:
+            info.append(str(e))
+            ec.append(res.EXCEPTION)
+            return False, info, ec
+        finally:
+            pool.close()
+            self.publishStats("scene_setup")
+
+    # Check if the input of the scene update service is valid
+    def validSceneUpdateInput(self, req):
+        tmp = dict()
+        tmp2 = EzSceneUpdateResponse()
+        info = []
+        error_codes = []
+        for model in list(req.added_objects) + list(req.added_obstacles):
+            if model.name == "":
+                info.append("Invalid service input: No model name provided")
+                error_codes.append(tmp2.NO_NAME)
+                return False, info, error_codes
+            if model.name in tmp or model.name in self.scene_models:
+                info.append("Invalid service input: Duplicate name: " + model.name)
+                error_codes.append(tmp2.DUPLICATE_NAME)
+                return False, info, error_codes
             else:
-                self.gripper_name = req.gripper.name
-                robotID = response.modelID
+                tmp[model.name] = 0
+            if model.graspit_file == "" and model.moveit_file == "":
+                info.append("Invalid service input: No file provided for model: " + model.name)
+                error_codes.append(tmp2.NO_FILENAME)
+                return False, info, error_codes
+            if model.pose.header.frame_id == "":
+                info.append("Invalid service input: No frame_id in PoseStamped message of model: " + model.name)
+                error_codes.append(tmp2.NO_FRAME_ID)
+                return False, info, error_codes
+        for name in req.removed:
+            if name not in self.scene_models:
+                info.append("Invalid service input: Unknown model: " + name)
+                error_codes.append(tmp2.UNKNOWN_NAME)
+                return False, info, error_codes
+        for model in req.moved:
+            if model.name not in self.scene_models or model.name in req.removed:
+                info.append("Invalid service input: Unknown model: " + model.name)
+                error_codes.append(tmp2.UNKNOWN_NAME)
+                return False, info, error_codes
+            if model.pose.header.frame_id == "":
+                info.append("Invalid service input: No frame_id in PoseStamped message of model: " + model.name)
+                error_codes.append(tmp2.NO_FRAME_ID)
+                return False, info, error_codes
+        return True, info, error_codes
 
+    # Load all remaining graspit models again, clearing the graspit world first.
+    # Graspit cannot unload a single model, so this is how removed models are dropped.
+    # Returns the info and error codes of any failure
+    def reloadGraspIt(self):
+        info = []
+        error_codes = []
+        clear = True
+        for kind, models in (("object", self.ez_objects), ("obstacle", self.ez_obstacles)):
+            for name in models:
                 loadm = LoadDatabaseModelRequest()
-                loadm.model_id = robotID
-                p = Pose()
+                loadm.model_id = models[name][0]
+                loadm.model_pose = self.fixItForGraspIt(self.scene_models[name][1], self.pose_factor)
+                loadm.clear_other_models = clear
+                clear = False
+                with self.stats.span("graspit_load_model"):
+                    response = self.load_model_srv(loadm)
+                if response.result != response.LOAD_SUCCESS:
+                    info.append("Error loading " + kind + " " + name + " to graspit world")
+                    error_codes.append(response.result)
+        if self.gripper_id is not None:
+            gripper_trans = self.lookupTF(self.gripper_frame, "world")
+            loadm = LoadDatabaseModelRequest()
+            loadm.model_id = self.gripper_id
+            loadm.model_pose.position.x = gripper_trans.transform.translation.x * self.pose_factor
+            loadm.model_pose.position.y = gripper_trans.transform.translation.y * self.pose_factor
+            loadm.model_pose.position.z = gripper_trans.transform.translation.z * self.pose_factor
+            loadm.clear_other_models = clear
+            with self.stats.span("graspit_load_model"):
+                response = self.load_model_srv(loadm)
+            if response.result != response.LOAD_SUCCESS:
+                info.append("Error loading robot " + self.gripper_name + " to graspit world")
+                error_codes.append(response.result)
+        return info, error_codes
 
-                gripper_trans = self.lookupTF(self.gripper_frame, "world")
+    # The scene update service callback, waits only while a planning request snapshots the scene
+    def sceneUpdate(self, req):
+        with self.scene_lock.writing():
+            return self.updateScene(req)
 
-                p.position.x = gripper_trans.transform.translation.x * self.pose_factor
-                p.position.y = gripper_trans.transform.translation.y * self.pose_factor
-                p.position.z = gripper_trans.transform.translation.z * self.pose_factor
-                loadm.model_pose = p
-                response = self.load_model_srv(loadm)
+    # Apply only the added, removed and moved models to the graspit world and the moveit scene,
+    # without adding the rest of the scene again
+    def updateScene(self, req):
+        valid, info, ec = self.validSceneUpdateInput(req)
 
-                if response.result != response.LOAD_SUCCESS:
-                    res.success = False
-                    res.info.append("Error loading robot " + req.gripper.name + " to graspit world")
-                    res.error_codes.append(response.result)
+        if not valid:
+            return valid, info, ec
+
+        self.stats.reset()
+
+        res = EzSceneUpdateResponse()
+
+        # The world is about to change, so previous ik results are no longer valid.
+        # Neither are the failures of the objects that change, nor (since any of them
+        # may have failed because of an obstacle) anyone's failures when an obstacle changes
+        if self.ik_cache is not None:
+            self.ik_cache.invalidate()
+        if self.failure_memory is not None:
+            changed = list(req.removed) + [m.name for m in req.moved]
+            if req.added_obstacles or any(self.scene_models[name][0] != "object" for name in changed):
+                self.failure_memory.forget()
+            else:
+                for name in changed + [m.name for m in req.added_objects]:
+                    self.failure_memory.forget(name)
+
+        pool = ThreadPool(max(1, self.scene_workers))
+        try:
+            # ------ Removed models ------
+            reload_graspit = False
+            for name in req.removed:
+                kind, model = self.scene_models.pop(name)
+                reload_graspit = self.ez_objects.pop(name, None) is not None or reload_graspit
+                reload_graspit = self.ez_obstacles.pop(name, None) is not None or reload_graspit
+                if model.moveit_file != "":
+                    self.moveit_scene.remove_world_object(name)
+                    if self.model_registry is not None:
+                        self.model_registry.forgetMoveIt(name)
             # ---------------------------
 
+            # ------ Moved models -------
+            moved = []
+            for m in req.moved:
+                model = self.scene_models[m.name][1]
+                model.pose = m.pose
+                # Update in place, so that anyone holding these entries sees the new pose
+                for models in (self.ez_objects, self.ez_obstacles):
+                    if m.name in models:
+                        models[m.name][1] = m.pose
+                moved.append(model)
+            # ---------------------------
+
+            # ------ Graspit world ------
+            if reload_graspit:
+                res.info, res.error_codes = self.reloadGraspIt()
+            else:
+                loaded = [model for model in moved if model.name in self.ez_objects or model.name in self.ez_obstacles]
+                def moveInGraspIt(model):
+                    loadm = LoadDatabaseModelRequest()
+                    loadm.model_id = (self.ez_objects.get(model.name) or self.ez_obstacles.get(model.name))[0]
+                    loadm.model_pose = self.fixItForGraspIt(model, self.pose_factor)
+                    with self.stats.span("graspit_load_model"):
+                        return self.load_model_srv(loadm)
+                for model, response in zip(loaded, pool.map(moveInGraspIt, loaded)):
+                    if response.result != response.LOAD_SUCCESS:
+                        res.info.append("Error loading " + self.scene_models[model.name][0] + " " + model.name + " to graspit world")
+                        res.error_codes.append(response.result)
+            added_info, added_ec = self.loadAllToGraspIt(pool, req.added_objects, req.added_obstacles)
+            res.info += added_info
+            res.error_codes += added_ec
+            res.success = len(res.info) == 0
+            # ---------------------------
+
+            # ------ Moveit scene -------
+            self.addToMoveIt(moved + list(req.added_objects) + list(req.added_obstacles))
+            # ---------------------------
+
+            for obj in req.added_objects:
+                self.scene_models[obj.name] = ["object", obj]
+            for obstacle in req.added_obstacles:
+                self.scene_models[obstacle.name] = ["obstacle", obstacle]
+
+            self.updateCollisionScreen()
+            self.saveSession()
+
             return res
 
         except Exception as e:
             info.append(str(e))
             ec.append(res.EXCEPTION)
             return False, info, ec
+        finally:
+            pool.close()
+            self.publishStats("scene_update")
+
+    # Rebuild the bounding boxes of the collision pre-screen, once per scene change
+    def updateCollisionScreen(self):
+        if self.collision_screen is not None:
+            self.collision_screen.update([model for kind, model in self.scene_models.values()])
+
+    # The scene knowledge that is kept in the session snapshot
+    def sessionSnapshot(self):
+        models = []
+        for name in self.scene_models:
+            kind, model = self.scene_models[name]
+            entry = self.ez_objects.get(name) or self.ez_obstacles.get(name)
+            models.append((kind, model, entry[0] if entry is not None else None))
+        return {"gripper_name": self.gripper_name,
+                "gripper_file": self.gripper_file,
+                "gripper_frame": self.gripper_frame,
+                "gripper_id": self.gripper_id,
+                "pose_factor": self.pose_factor,
+                "models": models,
+                "graspit_ids": self.model_registry.graspitIDs() if self.model_registry is not None else dict()}
+
+    def saveSession(self):
+        if self.session is not None:
+            try:
+                self.session.save(self.sessionSnapshot())
+            except Exception as e:
+                print "saveSession:" + str(e)
+
+    def clearScene(self):
+        self.ez_objects = dict()
+        self.ez_obstacles = dict()
+        self.scene_models = dict()
+        self.gripper_name = None
+        self.gripper_file = None
+        self.gripper_id = None
+
+    # Resume the scene of the last session snapshot, if there is one.
+    # The snapshot is only used if graspit can still load all of its models by their IDs,
+    # in which case no scene setup is needed
+    def resumeSession(self):
+        with self.scene_lock.writing():
+            return self.resumeScene()
+
+    def resumeScene(self):
+        if self.session is None:
+            return False
+        snapshot = self.session.load()
+        if snapshot is None:
+            return False
+        self.clearScene()
+        self.gripper_name = snapshot["gripper_name"]
+        self.gripper_file = snapshot.get("gripper_file")
+        self.gripper_frame = snapshot["gripper_frame"]
+        self.gripper_id = snapshot["gripper_id"]
+        self.pose_factor = snapshot["pose_factor"]
+        for kind, model, model_id in snapshot["models"]:
+            self.scene_models[model.name] = [kind, model]
+            if model_id is not None:
+                if kind == "object":
+                    self.ez_objects[model.name] = [model_id, model.pose]
+                else:
+                    self.ez_obstacles[model.name] = [model_id, model.pose]
+        try:
+            info, error_codes = self.reloadGraspIt()
+        except Exception as e:
+            print "resumeSession:" + str(e)
+            self.clearScene()
+            return False
+        if info:
+            rospy.logwarn("ez_pnp: Discarding the session snapshot: " + ", ".join(info))
+            self.clearScene()
+            self.session.clear()
+            return False
+
+        if self.model_registry is not None:
+            self.model_registry.restoreGraspitIDs(snapshot["graspit_ids"])
+
+        # Moveit might have been restarted too
+        known = set(self.moveit_scene.get_known_object_names())
+        self.addToMoveIt([model for kind, model in self.scene_models.values() if model.name not in known])
+        self.updateCollisionScreen()
+
+        rospy.loginfo("ez_pnp: Resumed the session with " + str(len(self.scene_models)) + " models")
+        return True
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+import numpy
+
+# Batched pose algebra for the ez_pick_and_place pipeline.
+# Poses are stored as arrays of 7 floats: [x, y, z, qx, qy, qz, qw]
+# (the same quaternion order tf uses), either as a single (7,) pose
+# or stacked as an (N, 7) array.
+
+# Hamilton product q1 * q0 for (..., 4) quaternion arrays
+# (same result as tf.transformations.quaternion_multiply)
+def quaternionMultiply(q1, q0):
+    q1 = numpy.asarray(q1, dtype=numpy.float64)
+    q0 = numpy.asarray(q0, dtype=numpy.float64)
+    x1, y1, z1, w1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    x0, y0, z0, w0 = q0[..., 0], q0[..., 1], q0[..., 2], q0[..., 3]
+    return numpy.stack((
+        x1 * w0 + y1 * z0 - z1 * y0 + w1 * x0,
+        -x1 * z0 + y1 * w0 + z1 * x0 + w1 * y0,
+        x1 * y0 - y1 * x0 + z1 * w0 + w1 * z0,
+        -x1 * x0 - y1 * y0 - z1 * z0 + w1 * w0), axis=-1)
+
+# Quaternions of pure yaw rotations, one per input angle
+# (same result as quaternion_from_euler(0, 0, yaw))
+def yawQuaternions(yaw):
+    half = numpy.asarray(yaw, dtype=numpy.float64) * 0.5
+    zeros = numpy.zeros_like(half)
+    return numpy.stack((zeros, zeros, numpy.sin(half), numpy.cos(half)), axis=-1)
+
+# Based on the specified center, find positions in a circle with the specified radius,
+# mirror them to all four quadrants and rotate the specified quaternion about z
+# so that each candidate "looks at" the center.
+# The result is an (N, 7) array of poses, all at height z.
+def gyrate(center, radius, quat, step, z=0.0):
+    xs = numpy.arange(center[0] - radius, center[0] + radius, step)
+    ys = numpy.arange(center[1] - radius, center[1] + radius, step)
+    x, y = numpy.meshgrid(xs, ys, indexing="ij")
+    x_center = x - center[0]
+    y_center = y - center[1]
+    inside = (x_center**2 + y_center**2) <= radius**2
+    x = x[inside]
+    y = y[inside]
+    x_ = center[0] - x_center[inside]
+    y_ = center[1] - y_center[inside]
+
+    # Keep the (x, y), (x_, y), (x, y_), (x_, y_) order for each grid cell
+    px = numpy.stack((x, x_, x, x_), axis=-1).ravel()
+    py = numpy.stack((y, y, y_, y_), axis=-1).ravel()
+    yaw = numpy.arctan2(py - center[1], px - center[0])
+
+    poses = numpy.empty((px.shape[0], 7))
+    poses[:, 0] = px
+    poses[:, 1] = py
+    poses[:, 2] = z
+    poses[:, 3:] = quaternionMultiply(yawQuaternions(yaw), quat)
+    return poses
+
+# Hashable, quantized version of a (7,) pose.
+# q and -q are the same rotation, so the quaternion is kept with a non negative w
+def quantizePose(pose, position_resolution=0.001, orientation_resolution=0.001):
+    pose = numpy.asarray(pose, dtype=numpy.float64)
+    q = pose[3:] if pose[6] >= 0 else -pose[3:]
+    return tuple(numpy.round(pose[:3] / position_resolution).astype(int)) + tuple(numpy.round(q / orientation_resolution).astype(int))
+
+# GraspIt and MoveIt appear to have a 90 degree difference in the x axis (roll 90 degrees)
+GRASPIT_TO_MOVEIT = numpy.array([0.0, 0.0, 0.0, numpy.sqrt(0.5), 0.0, 0.0, numpy.sqrt(0.5)])
+
+# Inverse of unit (..., 4) quaternions
+def quaternionConjugate(q):
+    q = numpy.array(q, dtype=numpy.float64)
+    q[..., :3] *= -1
+    return q
+
+# Rotate (..., 3) vectors by (..., 4) unit quaternions
+def rotate(q, v):
+    q = numpy.asarray(q, dtype=numpy.float64)
+    v = numpy.asarray(v, dtype=numpy.float64)
+    u = q[..., :3]
+    uv = numpy.cross(u, v)
+    return v + 2.0 * (q[..., 3:] * uv + numpy.cross(u, uv))
+
+# (..., 3, 3) rotation matrices of (..., 4) unit quaternions
+def rotationMatrices(q):
+    q = numpy.asarray(q, dtype=numpy.float64)
+    x, y, z, w = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    return numpy.stack((
+        numpy.stack((1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)), axis=-1),
+        numpy.stack((2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)), axis=-1),
+        numpy.stack((2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)), axis=-1)), axis=-2)
+
+# Chain two (..., 7) poses, i.e. express p2 (given relative to p1) in p1's parent frame
+def composePoses(p1, p2):
+    p1 = numpy.asarray(p1, dtype=numpy.float64)
+    p2 = numpy.asarray(p2, dtype=numpy.float64)
+    res = numpy.empty(numpy.broadcast(p1, p2).shape)
+    res[..., :3] = p1[..., :3] + rotate(p1[..., 3:], p2[..., :3])
+    res[..., 3:] = quaternionMultiply(p1[..., 3:], p2[..., 3:])
+    return res
+
+# Inverse of (..., 7) poses
+def invertPose(p):
+    p = numpy.asarray(p, dtype=numpy.float64)
+    res = numpy.empty(p.shape)
+    res[..., 3:] = quaternionConjugate(p[..., 3:])
+    res[..., :3] = -rotate(res[..., 3:], p[..., :3])
+    return res
+
+# geometry_msgs/Pose -> (7,) array
+def poseToArray(pose):
+    return numpy.array([pose.position.x, pose.position.y, pose.position.z, pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w])
+
+# List of geometry_msgs/Pose -> (N, 7) array
+def posesToArray(poses):
+    return numpy.array([poseToArray(p) for p in poses]).reshape(-1, 7)
+
+# geometry_msgs/Transform -> (7,) array
+def transformToArray(transform):
+    return numpy.array([transform.translation.x, transform.translation.y, transform.translation.z, transform.rotation.x, transform.rotation.y, transform.rotation.z, transform.rotation.w])
+
+# Fill the specified geometry_msgs/Pose with a (7,) array and return it
+def arrayToPose(arr, pose):
+    pose.position.x, pose.position.y, pose.position.z = [float(v) for v in arr[:3]]
+    pose.orientation.x, pose.orientation.y, pose.orientation.z, pose.orientation.w = [float(v) for v in arr[3:]]
+    return pose
+
+# Translate (N, 7) GraspIt grasp poses (relative to the object) to world-frame end effector poses.
+# object_pose is the object wrt the world and ee_gripper is the gripper frame wrt the end effector.
+# Chain: World -> Object -> Gripper -> End Effector -> (GraspIt to MoveIt) End Effector
+def graspIt2MoveIt(object_pose, grasp_poses, ee_gripper):
+    # Gripper -> End Effector, as the original helper frame defined it:
+    # negated translation, same rotation
+    gripper_ee = numpy.array(ee_gripper, dtype=numpy.float64)
+    gripper_ee[:3] *= -1
+    tail = composePoses(gripper_ee, GRASPIT_TO_MOVEIT)
+    return composePoses(composePoses(object_pose, grasp_poses), tail)
+
+# Closed form place pose computation (all poses wrt the place frame).
+# Returns the picked object's pose at the place position (keeping its current orientation)
+# and the object's pose relative to the end effector, which it is carried with
+def placePose(object_pose, place_position, ee_pose):
+    carried = composePoses(invertPose(ee_pose), object_pose)
+    target_object_pose = numpy.array(object_pose, dtype=numpy.float64)
+    target_object_pose[:3] = place_position
+    return target_object_pose, carried
+
+# Estimated cost of moving from start_pose to each of the (N, 7) poses:
+# the translation distance plus the rotation angle (in radians) scaled by yaw_weight
+def motionCost(poses, start_pose, yaw_weight):
+    poses = numpy.asarray(poses, dtype=numpy.float64).reshape(-1, 7)
+    distance = numpy.linalg.norm(poses[:, :3] - start_pose[:3], axis=1)
+    dot = numpy.clip(numpy.abs(poses[:, 3:].dot(start_pose[3:])), 0.0, 1.0)
+    angle = 2.0 * numpy.arccos(dot)
+    return distance + yaw_weight * angle
+
+# Indices that sort (N, 7) end effector place candidates by how far (in xy, rounded to resolution)
+# the carried object lands from place_position, and equally close ones by their motion cost from start_pose
+def rankPlaceCandidates(poses, carried, place_position, start_pose, yaw_weight, resolution=0.01):
+    poses = numpy.asarray(poses, dtype=numpy.float64).reshape(-1, 7)
+    landed = composePoses(poses, carried)
+    error = numpy.round(numpy.linalg.norm(landed[:, :2] - place_position[:2], axis=1) / resolution)
+    return numpy.lexsort((motionCost(poses, start_pose, yaw_weight), error))
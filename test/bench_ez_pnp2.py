@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import ez_fakes
+import ez_tools
+
+from ez_ik import EZIKPool, EZIKCache
+from ez_registry import EZModelRegistry
+from ez_grasps import EZGraspCache
+from ez_tools import EZToolSet
+from ez_pick_and_place.srv import EzSceneSetupRequest, EzStartPlanningRequest
+from ez_pick_and_place.msg import EzModel
+from geometry_msgs.msg import PoseStamped
+
+# Note:
+# This benchmark does not need GraspIt, MoveIt or a robot!
+# It drives EZToolSet against the in-process fakes of ez_fakes.py,
+# and reports wall time and call counts per pipeline stage.
+# Run it with: rosrun ez_pick_and_place bench_ez_pnp2.py (or python test/bench_ez_pnp2.py)
+
+STAGES = ["sceneSetup", "graspThis", "translateGraspIt2MoveIt", "validGrasps", "pick", "calcTargetPose", "place"]
+
+# Accumulates wall time and calls of the wrapped EZToolSet methods.
+# Methods are wrapped in a subclass, so that the request sessions
+# (copies of the toolset) are timed too
+class StageTimer():
+
+    def __init__(self):
+        self.durations = dict((s, 0.0) for s in STAGES)
+        self.calls = dict((s, 0) for s in STAGES)
+        self.lock = threading.Lock()
+
+    def add(self, stage, duration, calls):
+        with self.lock:
+            self.durations[stage] += duration
+            self.calls[stage] += calls
+
+    def wrap(self, cls, method, stage):
+        f = getattr(cls, method)
+        def timed(ez, *args, **kwargs):
+            start = time.time()
+            try:
+                return f(ez, *args, **kwargs)
+            finally:
+                self.add(stage, time.time() - start, 1)
+        setattr(cls, method, timed)
+
+    # Generators are timed only while they run, not while their consumer does
+    def wrapGenerator(self, cls, method, stage):
+        f = getattr(cls, method)
+        def timed(ez, *args, **kwargs):
+            self.add(stage, 0.0, 1)
+            gen = f(ez, *args, **kwargs)
+            try:
+                while True:
+                    start = time.time()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        return
+                    finally:
+                        self.add(stage, time.time() - start, 0)
+                    yield item
+            finally:
+                gen.close()
+        setattr(cls, method, timed)
+
+def makeToolSet(args, grasps, cls=EZToolSet):
+    ez = cls()
+    # The class level dicts would leak between scenarios
+    ez.ez_objects = dict()
+    ez.ez_obstacles = dict()
+    ez.scene_models = dict()
+    ez.gripper_joint_bounds = dict()
+
+    ez.moveit_scene = ez_fakes.FakePlanningScene(latency=args.scene_latency)
+    ez.planning_scene_pub = ez.moveit_scene
+    ez.tf2_buffer = ez_fakes.FakeTFBuffer("tf_lookup", latency=args.tf_latency)
+    ez.add_model_srv = ez_fakes.FakeAddModel("graspit_add_to_database", latency=args.graspit_latency)
+    ez.load_model_srv = ez_fakes.FakeLoadModel("graspit_load_model", latency=args.graspit_latency)
+    ez.planning_srv = ez_fakes.FakeGraspPlanning("graspit_eg_planning", latency=args.planning_latency, grasps=grasps)
+    ik = ez_fakes.FakeIK("compute_ik", latency=args.ik_latency, success_rate=args.ik_success)
+    ez.ik_cache = EZIKCache(args.ik_cache_size)
+    ez.ik_pool = EZIKPool(lambda: ik, args.ik_workers, ez.ik_cache)
+    ez.model_registry = EZModelRegistry()
+    ez.grasp_cache = EZGraspCache()
+    ez.settle_detector = ez_fakes.FakeSettleDetector()
+    ez.scene_workers = args.scene_workers
+    return ez
+
+def sceneRequest(obstacles, workdir):
+    graspit_file = os.path.join(workdir, "model.xml")
+    if not os.path.isfile(graspit_file):
+        with open(graspit_file, "w") as f:
+            f.write("<root/>")
+    req = EzSceneSetupRequest()
+    req.gripper.name = "fake_gripper"
+    req.gripper.graspit_file = graspit_file
+    req.finger_joint_names = list(ez_fakes.GRIPPER_JOINTS)
+    req.gripper_frame = "gripper_center_link"
+
+    obj = EzModel()
+    obj.name = "target"
+    obj.graspit_file = graspit_file
+    obj.pose.header.frame_id = "world"
+    obj.pose.pose.position.x = 0.3
+    obj.pose.pose.position.z = 0.1
+    obj.pose.pose.orientation.w = 1.0
+    req.objects.append(obj)
+
+    for i in xrange(obstacles):
+        obstacle = EzModel()
+        obstacle.name = "obstacle_" + str(i)
+        obstacle.graspit_file = graspit_file
+        obstacle.pose.header.frame_id = "world"
+        obstacle.pose.pose.position.x = -0.5 + 0.05 * i
+        obstacle.pose.pose.orientation.w = 1.0
+        req.obstacles.append(obstacle)
+    return req
+
+def planningRequest(max_replanning, arm="arm", gripper="gripper"):
+    target_place = PoseStamped()
+    target_place.header.frame_id = "world"
+    target_place.pose.position.x = -0.3
+    target_place.pose.position.y = 0.2
+    target_place.pose.orientation.w = 1.0
+
+    req = EzStartPlanningRequest()
+    req.graspit_target_object = "target"
+    req.target_place = target_place
+    req.arm_move_group = arm
+    req.gripper_move_group = gripper
+    req.max_replanning = max_replanning
+    return req
+
+# Run one scene setup and then one planning request per arm (concurrently), and return the stage timer
+def runScenario(args, workdir, grasps, obstacles, max_replanning, move_success, arms=1):
+    class TimedToolSet(EZToolSet):
+        pass
+    timer = StageTimer()
+    for stage in STAGES:
+        if stage == "validGrasps":
+            timer.wrapGenerator(TimedToolSet, stage, stage)
+        else:
+            timer.wrap(TimedToolSet, stage, stage)
+    ez = makeToolSet(args, grasps, TimedToolSet)
+
+    # startPlanning creates its own commanders, so hand it the fakes instead
+    robot = ez_fakes.FakeRobotCommander()
+    ez_tools.moveit_commander.RobotCommander = lambda: robot
+    ez_tools.moveit_commander.MoveGroupCommander = lambda name: ez_fakes.FakeMoveGroup(name, args.move_latency, move_success if name.startswith("arm") else 1.0)
+
+    ez_fakes.counters.reset()
+    start = time.time()
+    ez.sceneSetup(sceneRequest(obstacles, workdir))
+    results = [None] * arms
+    def plan(i):
+        results[i] = ez.startPlanning(planningRequest(max_replanning, "arm_" + str(i), "gripper_" + str(i)))
+    threads = [threading.Thread(target=plan, args=(i,)) for i in xrange(arms)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.time() - start
+    return timer, dict(ez_fakes.counters.calls), total, all(res is not None and res.success for res in results)
+
+def report(name, timer, calls, total, success):
+    print "=== " + name + " (" + ("success" if success else "failure") + ", " + ("%.3f" % total) + "s total)"
+    for stage in STAGES:
+        print "  %-26s %9.4fs  %5d calls" % (stage, timer.durations[stage], timer.calls[stage])
+    for service in sorted(calls):
+        print "  %-26s %16d calls" % (service, calls[service])
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the ez_pick_and_place pipeline")
+    parser.add_argument("--ik-latency", type=float, default=0.002)
+    parser.add_argument("--ik-success", type=float, default=0.2)
+    parser.add_argument("--ik-workers", type=int, default=4)
+    parser.add_argument("--ik-cache-size", type=int, default=4096)
+    parser.add_argument("--graspit-latency", type=float, default=0.005)
+    parser.add_argument("--planning-latency", type=float, default=0.5)
+    parser.add_argument("--tf-latency", type=float, default=0.0)
+    parser.add_argument("--scene-latency", type=float, default=0.001)
+    parser.add_argument("--scene-workers", type=int, default=4)
+    parser.add_argument("--move-latency", type=float, default=0.01)
+    parser.add_argument("--move-success", type=float, default=1.0)
+    parser.add_argument("--grasps", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--obstacles", type=int, nargs="+", default=[0, 20, 40])
+    parser.add_argument("--replanning", type=int, nargs="+", default=[0, 2, 5])
+    parser.add_argument("--arms", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ez_bench_")
+    try:
+        for g in args.grasps:
+            report("grasps=" + str(g), *runScenario(args, workdir, g, 0, 0, args.move_success))
+        for o in args.obstacles:
+            report("obstacles=" + str(o), *runScenario(args, workdir, args.grasps[0], o, 0, args.move_success))
+        # Arm motions always fail, so every replanning iteration runs
+        for r in args.replanning:
+            report("replanning=" + str(r), *runScenario(args, workdir, args.grasps[0], 0, r, 0.0))
+        # One request per arm, all of them at once
+        for a in args.arms:
+            report("arms=" + str(a), *runScenario(args, workdir, args.grasps[0], 0, 0, args.move_success, a))
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+import time
+import random
+import threading
+
+from geometry_msgs.msg import Pose, TransformStamped
+from trajectory_msgs.msg import JointTrajectoryPoint
+from moveit_msgs.msg import Grasp, RobotState, AttachedCollisionObject, MoveItErrorCodes
+from moveit_msgs.srv import GetPositionIKResponse, GraspPlanningResponse
+from grasp_planning_graspit_msgs.srv import AddToDatabaseResponse, LoadDatabaseModelResponse
+
+# In-process stand-ins for the services, tf buffer and moveit commanders that EZToolSet uses,
+# so that the whole pipeline can run (and be timed) without GraspIt, MoveIt or a robot.
+# Every fake has a configurable latency (seconds per call) and success rate,
+# and counts how many times it was called
+
+ARM_JOINTS = ["shoulder_pan_joint", "shoulder_lift_joint", "elbow_joint", "wrist_1_joint", "wrist_2_joint", "wrist_3_joint"]
+GRIPPER_JOINTS = ["finger1_joint", "finger2_joint"]
+
+# Call counters shared by all fakes, so the benchmark can report them per stage
+class FakeCounters():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = dict()
+
+    def count(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def reset(self):
+        with self.lock:
+            self.calls = dict()
+
+counters = FakeCounters()
+
+# Base of every fake service: sleeps for the configured latency,
+# and decides success with a seeded random generator
+class FakeService():
+
+    def __init__(self, name, latency=0.0, success_rate=1.0, seed=0):
+        self.name = name
+        self.latency = latency
+        self.success_rate = success_rate
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def wait(self):
+        counters.count(self.name)
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def succeed(self):
+        with self.lock:
+            return self.rand.random() < self.success_rate
+
+# /compute_ik. The outcome only depends on the requested pose,
+# so that identical requests (e.g. across replanning iterations) get identical answers
+class FakeIK(FakeService):
+
+    def __call__(self, req):
+        self.wait()
+        p = req.ik_request.pose_stamped.pose.position
+        res = GetPositionIKResponse()
+        if random.Random(hash((round(p.x, 3), round(p.y, 3), round(p.z, 3)))).random() < self.success_rate:
+            res.error_code.val = MoveItErrorCodes.SUCCESS
+            res.solution.joint_state.name = list(ARM_JOINTS)
+            res.solution.joint_state.position = [0.0] * len(ARM_JOINTS)
+        else:
+            res.error_code.val = MoveItErrorCodes.NO_IK_SOLUTION
+        return res
+
+# /graspit_eg_planning, returns the configured number of grasps around the object
+class FakeGraspPlanning(FakeService):
+
+    def __init__(self, name, latency=0.0, success_rate=1.0, seed=0, grasps=50):
+        FakeService.__init__(self, name, latency, success_rate, seed)
+        self.grasps = grasps
+
+    def __call__(self, group_name="", target=None):
+        self.wait()
+        res = GraspPlanningResponse()
+        if not self.succeed():
+            return res
+        for i in xrange(self.grasps):
+            g = Grasp()
+            g.id = str(i)
+            with self.lock:
+                g.grasp_pose.pose.position.x = self.rand.uniform(-0.1, 0.1)
+                g.grasp_pose.pose.position.y = self.rand.uniform(-0.1, 0.1)
+                g.grasp_pose.pose.position.z = self.rand.uniform(0.05, 0.15)
+                g.grasp_quality = self.rand.uniform(0.0, 1.0)
+            g.grasp_pose.pose.orientation.w = 1.0
+            g.grasp_posture.joint_names = list(GRIPPER_JOINTS)
+            g.grasp_posture.points = [JointTrajectoryPoint(positions=[10.0] * len(GRIPPER_JOINTS))]
+            res.grasps.append(g)
+        return res
+
+# /graspit_add_to_database
+class FakeAddModel(FakeService):
+
+    def __init__(self, name, latency=0.0, success_rate=1.0, seed=0):
+        FakeService.__init__(self, name, latency, success_rate, seed)
+        self.next_id = 1
+
+    def __call__(self, req):
+        self.wait()
+        res = AddToDatabaseResponse()
+        if self.succeed():
+            with self.lock:
+                res.modelID = self.next_id
+                self.next_id += 1
+            res.returnCode = res.SUCCESS
+        else:
+            # Any other code is an error
+            res.returnCode = res.SUCCESS + 1
+        return res
+
+# /graspit_load_model
+class FakeLoadModel(FakeService):
+
+    def __call__(self, req):
+        self.wait()
+        res = LoadDatabaseModelResponse()
+        # Any other result is an error
+        res.result = res.LOAD_SUCCESS if self.succeed() else res.LOAD_SUCCESS + 1
+        return res
+
+# tf2_ros.Buffer, every lookup returns the identity transform
+class FakeTFBuffer(FakeService):
+
+    def lookup_transform(self, target_frame, source_frame, time=None, timeout=None):
+        self.wait()
+        t = TransformStamped()
+        t.header.frame_id = target_frame
+        t.child_frame_id = source_frame
+        t.transform.rotation.w = 1.0
+        return t
+
+    def set_transform(self, transform, authority):
+        counters.count(self.name + "_set")
+
+class FakeJoint():
+
+    def max_bound(self):
+        return 0.04
+
+# moveit_commander.RobotCommander
+class FakeRobotCommander(FakeService):
+
+    def __init__(self, name="robot_commander", latency=0.0, success_rate=1.0, seed=0):
+        FakeService.__init__(self, name, latency, success_rate, seed)
+
+    def get_current_state(self):
+        self.wait()
+        state = RobotState()
+        state.joint_state.name = ARM_JOINTS + GRIPPER_JOINTS
+        state.joint_state.position = [0.0] * len(state.joint_state.name)
+        return state
+
+    def get_joint(self, name):
+        return FakeJoint()
+
+    def get_link_names(self, group=None):
+        self.wait()
+        return ["finger1_link", "finger2_link"]
+
+# moveit_commander.MoveGroupCommander, go() takes latency seconds and succeeds with success_rate
+class FakeMoveGroup(FakeService):
+
+    def __init__(self, group_name, latency=0.0, success_rate=1.0, seed=0):
+        FakeService.__init__(self, "move_group_" + group_name, latency, success_rate, seed)
+        self.group_name = group_name
+
+    def set_pose_target(self, pose):
+        pass
+
+    def set_joint_value_target(self, state):
+        pass
+
+    def set_start_state_to_current_state(self):
+        pass
+
+    def go(self):
+        self.wait()
+        return self.succeed()
+
+    def get_end_effector_link(self):
+        return "ee_link"
+
+    def get_joints(self):
+        return GRIPPER_JOINTS if self.group_name.startswith("gripper") else ARM_JOINTS
+
+    def get_active_joints(self):
+        return self.get_joints()
+
+    def attach_object(self, name, link_name=None, touch_links=None):
+        counters.count("attach_object")
+
+    def detach_object(self, name):
+        counters.count("detach_object")
+
+# moveit_commander.PlanningSceneInterface (and the planning scene publisher)
+class FakePlanningScene(FakeService):
+
+    def __init__(self, name="planning_scene", latency=0.0, success_rate=1.0, seed=0):
+        FakeService.__init__(self, name, latency, success_rate, seed)
+        self.poses = dict()
+
+    def add_mesh(self, name, pose, filename):
+        self.wait()
+        self.poses[name] = pose.pose
+
+    def remove_world_object(self, name):
+        self.wait()
+        self.poses.pop(name, None)
+
+    def publish(self, scene):
+        self.wait()
+        for co in scene.world.collision_objects:
+            self.poses[co.id] = co.mesh_poses[0]
+
+    def get_known_object_names(self):
+        return self.poses.keys()
+
+    def get_object_poses(self, names):
+        return dict((n, self.poses.get(n, Pose())) for n in names)
+
+    def get_attached_objects(self, names):
+        res = dict()
+        for n in names:
+            res[n] = AttachedCollisionObject()
+            res[n].object.id = n
+        return res
+
+# Settle detector that never waits
+class FakeSettleDetector():
+
+    def waitForStill(self, stage, joints=None):
+        return True
+
+    def waitForAttached(self, stage, scene, object_name):
+        return True
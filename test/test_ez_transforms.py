@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+import os
+import sys
+import numpy
+import unittest
+
+from tf import transformations
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import ez_transforms
+
+# Note:
+# Checks the batched pose algebra of ez_transforms.py against tf.transformations.
+# It does not need a ROS master, GraspIt or MoveIt.
+# Run it with: python test/test_ez_transforms.py
+
+# 4x4 matrix of a (7,) pose
+def poseMatrix(pose):
+    m = transformations.quaternion_matrix(pose[3:])
+    m[:3, 3] = pose[:3]
+    return m
+
+# (N, 7) random poses, with positions in [-1, 1]
+def randomPoses(rand, n):
+    return numpy.array([numpy.r_[rand.uniform(-1, 1, 3), transformations.random_quaternion(rand.rand(3))] for i in xrange(n)])
+
+class TestEZTransforms(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = numpy.random.RandomState(0)
+
+    # Compared as matrices, since q and -q are the same rotation
+    def assertSamePose(self, pose, m):
+        numpy.testing.assert_allclose(poseMatrix(pose), m, atol=1e-9)
+
+    def testComposePoses(self):
+        p1, p2 = randomPoses(self.rand, 10), randomPoses(self.rand, 10)
+        res = ez_transforms.composePoses(p1, p2)
+        for i in xrange(len(res)):
+            self.assertSamePose(res[i], transformations.concatenate_matrices(poseMatrix(p1[i]), poseMatrix(p2[i])))
+
+    def testInvertPose(self):
+        p = randomPoses(self.rand, 10)
+        res = ez_transforms.invertPose(p)
+        for i in xrange(len(res)):
+            self.assertSamePose(res[i], transformations.inverse_matrix(poseMatrix(p[i])))
+
+    def testPlacePose(self):
+        object_pose, ee_pose = randomPoses(self.rand, 2)
+        place_position = self.rand.uniform(-1, 1, 3)
+        target_object_pose, carried = ez_transforms.placePose(object_pose, place_position, ee_pose)
+        numpy.testing.assert_allclose(target_object_pose, numpy.r_[place_position, object_pose[3:]])
+        # The object wrt the end effector
+        self.assertSamePose(carried, transformations.concatenate_matrices(transformations.inverse_matrix(poseMatrix(ee_pose)), poseMatrix(object_pose)))
+
+    def testGraspIt2MoveIt(self):
+        object_pose = randomPoses(self.rand, 1)[0]
+        grasp_poses = randomPoses(self.rand, 10)
+        ee_gripper = randomPoses(self.rand, 1)[0]
+        res = ez_transforms.graspIt2MoveIt(object_pose, grasp_poses, ee_gripper)
+        # Object -> Grasp -> End Effector (negated translation, same rotation) -> roll by 90 degrees
+        tail = transformations.concatenate_matrices(transformations.translation_matrix(-ee_gripper[:3]),
+                                                    transformations.quaternion_matrix(ee_gripper[3:]),
+                                                    transformations.euler_matrix(numpy.pi / 2, 0, 0))
+        for i in xrange(len(res)):
+            self.assertSamePose(res[i], transformations.concatenate_matrices(poseMatrix(object_pose), poseMatrix(grasp_poses[i]), tail))
+
+    # The first place candidate puts the object near the place position, not near where it was picked
+    def testRankPlaceCandidates(self):
+        ee_pose = numpy.r_[0.4, 0.1, 0.3, transformations.quaternion_from_euler(0, numpy.pi / 2, 0)]
+        object_pose = numpy.array([0.4, 0.1, 0.15, 0.0, 0.0, 0.0, 1.0])
+        place_position = numpy.array([-0.1, 0.5, 0.15])
+        target_object_pose, carried = ez_transforms.placePose(object_pose, place_position, ee_pose)
+        radius = numpy.linalg.norm(target_object_pose[:2] - ee_pose[:2])
+        candidates = ez_transforms.gyrate(target_object_pose[:2], radius, ee_pose[3:], 0.1, ee_pose[2])
+        first = candidates[ez_transforms.rankPlaceCandidates(candidates, carried, place_position, ee_pose, 0.1)[0]]
+        landed = ez_transforms.composePoses(first, carried)
+        self.assertLess(numpy.linalg.norm(landed[:2] - place_position[:2]), 0.1)
+        self.assertGreater(numpy.linalg.norm(first[:2] - ee_pose[:2]), radius / 2)
+
+if __name__ == "__main__":
+    unittest.main()